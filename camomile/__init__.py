@@ -34,6 +34,14 @@ del get_versions
 
 
 from .client import Camomile
+from .client import CamomileTransport
+from .columnar import AnnotationArray
+from .index import IntervalIndex
+from .mirror import LayerMirror
+from .cache import AnnotationCache
+from .media import MediaCache
+from .resolver import NameResolver
+from .queue import QueueWorker, QueueProducer
 from .client import CamomileBadRequest, \
                     CamomileUnauthorized, \
                     CamomileForbidden, \
@@ -41,4 +49,14 @@ from .client import CamomileBadRequest, \
                     CamomileBadJSON, \
                     CamomileInternalError
 
-__all__ = ['Camomile']
+__all__ = ['Camomile', 'CamomileTransport', 'AnnotationArray',
+           'IntervalIndex', 'LayerMirror', 'AnnotationCache', 'MediaCache',
+           'NameResolver', 'QueueWorker', 'QueueProducer']
+
+try:
+    # asyncio-native client needs Python 3.5+
+    from .aio import AsyncCamomile
+except SyntaxError:
+    pass
+else:
+    __all__.append('AsyncCamomile')
@@ -0,0 +1,1335 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""asyncio-native client for Camomile REST API (Python 3.5+)"""
+
+import asyncio
+import functools
+import json
+import os
+import warnings
+from base64 import b64encode, b64decode
+from getpass import getpass
+
+from requests.models import RequestEncodingMixin
+from tortilla.utils import bunchify
+
+from .client import Camomile, CamomileBadJSON, CamomileNotFound, \
+    CAMOMILE_EXCEPTIONS
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncCamomileErrorHandling(object):
+    """Decorator for handling "keep alive" behavior of coroutine methods
+
+    HTTP errors are already converted to Camomile exceptions by the route
+    themselves. This decorator takes care of re-logging (at most once at a
+    time, whatever the number of pending requests) on connection or
+    authentication errors.
+
+    Parameters
+    ----------
+    resuscitate : boolean, optional
+        See `CamomileErrorHandling`.
+    """
+
+    def __init__(self, resuscitate=True):
+        super(AsyncCamomileErrorHandling, self).__init__()
+        self.resuscitate = resuscitate
+
+    def __call__(self, func):
+
+        @functools.wraps(func)
+        async def decorated_method(client, *args, **kwargs):
+            generation = client._generation
+            try:
+                return await func(client, *args, **kwargs)
+
+            except (aiohttp.ClientConnectionError,
+                    CAMOMILE_EXCEPTIONS[401]):
+                if not (self.resuscitate and client._keep_alive):
+                    raise
+
+            await client._resuscitate(generation=generation)
+            return await func(client, *args, **kwargs)
+
+        return decorated_method
+
+
+class _Route(object):
+    """Chainable URL, mimicking `tortilla.Wrap` with coroutine verbs"""
+
+    def __init__(self, client, url):
+        super(_Route, self).__init__()
+        self._client = client
+        self._url = url
+
+    def __call__(self, *parts):
+        url = self._url
+        for part in parts:
+            url = '{url}/{part}'.format(url=url, part=part)
+        return _Route(self._client, url)
+
+    def __getattr__(self, part):
+        if part.startswith('_'):
+            raise AttributeError(part)
+        return self(part)
+
+    def get(self, *parts, **options):
+        return self._client._request('GET', self(*parts)._url, **options)
+
+    def post(self, *parts, **options):
+        return self._client._request('POST', self(*parts)._url, **options)
+
+    def put(self, *parts, **options):
+        return self._client._request('PUT', self(*parts)._url, **options)
+
+    def delete(self, *parts, **options):
+        return self._client._request('DELETE', self(*parts)._url, **options)
+
+    def __repr__(self):
+        return '<_Route for {url}>'.format(url=self._url)
+
+
+class AsyncCamomile(object):
+    """asyncio-native client for Camomile REST API
+
+    Mirrors `Camomile` method by method (same names, parameters, returned
+    values and exceptions), except that every method is a coroutine and that
+    requests share a bounded pool of connections, so that hundreds of them
+    can be in flight in one event loop.
+
+    Requires `aiohttp`.
+
+    Parameters
+    ----------
+    url : str
+        Base URL of Camomile API.
+    username, password : str, optional
+        If provided, an attempt is made to log in when entering the
+        `async with` block.
+    keep_alive : boolean, optional
+        See `login`.
+    limit : int, optional
+        Maximum number of simultaneous connections.  Defaults to 100.
+    limit_per_host : int, optional
+        Maximum number of simultaneous connections to the same host.
+        Defaults to no specific limit.
+    timeout : float, optional
+        Total timeout of one request, in seconds.  Defaults to 300.
+    connect_timeout : float, optional
+        Connection timeout, in seconds.  Defaults to 10.
+
+    Example
+    -------
+    >>> async with AsyncCamomile(url, username='root',
+    ...                          password='password') as client:
+    ...     corpora = await client.getCorpora(returns_id=True)
+    ...     layers = await asyncio.gather(
+    ...         *[client.getLayers(corpus=corpus) for corpus in corpora])
+    """
+
+    ADMIN = Camomile.ADMIN
+    WRITE = Camomile.WRITE
+    READ = Camomile.READ
+
+    def __init__(self, url, username=None, password=None, keep_alive=False,
+                 limit=100, limit_per_host=0, timeout=300.,
+                 connect_timeout=10.):
+        super(AsyncCamomile, self).__init__()
+
+        if aiohttp is None:
+            raise ImportError('AsyncCamomile requires aiohttp.')
+
+        self._url = url.rstrip('/')
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._timeout = aiohttp.ClientTimeout(total=timeout,
+                                              sock_connect=connect_timeout)
+        self._session = None
+
+        self._credentials = None
+        if username:
+            self._credentials = (username, password, keep_alive)
+
+        self._keep_alive = None
+        self._generation = 0
+        self._login_lock = None
+
+        self._listenerCallbacks = {}
+        self._listener = None
+        self._channel_id = None
+
+    async def __aenter__(self):
+        if self._credentials:
+            username, password, keep_alive = self._credentials
+            await self.login(username, password, keep_alive=keep_alive)
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        try:
+            await self.logout()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stop listening to events and close all connections"""
+
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # HELPER FUNCTIONS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _getSession(self):
+        # aiohttp sessions must be created from within the event loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self._limit, limit_per_host=self._limit_per_host)
+            # Camomile is often served from a bare IP address
+            cookie_jar = aiohttp.CookieJar(unsafe=True)
+            self._session = aiohttp.ClientSession(
+                connector=connector, cookie_jar=cookie_jar,
+                timeout=self._timeout)
+        return self._session
+
+    async def _request(self, method, url, params=None, data=None, raw=False):
+
+        # encode query string exactly like requests (hence tortilla) does
+        if params:
+            url = '{url}?{query}'.format(
+                url=url, query=RequestEncodingMixin._encode_params(params))
+
+        kwargs = {}
+        if data is not None:
+            kwargs['data'] = json.dumps(data)
+            kwargs['headers'] = {'Content-Type': 'application/json'}
+
+        session = self._getSession()
+        async with session.request(method, url, **kwargs) as response:
+
+            content = await response.read()
+
+            if response.status >= 400:
+                self._raise(response.status, content)
+
+            if raw:
+                return content
+
+            if not content:
+                return None
+
+            return bunchify(json.loads(content.decode('utf-8')))
+
+    @staticmethod
+    def _raise(status_code, content):
+
+        try:
+            message = json.loads(content.decode('utf-8')).get('error', None)
+        except (ValueError, AttributeError):
+            raise CamomileBadJSON(content)
+
+        if message is not None and status_code in CAMOMILE_EXCEPTIONS:
+            raise CAMOMILE_EXCEPTIONS[status_code](message)
+
+        raise aiohttp.ClientResponseError(
+            None, (), status=status_code,
+            message=content.decode('utf-8', 'replace'))
+
+    def _route(self, *parts):
+        return _Route(self, self._url)(*parts)
+
+    def _user(self, id_user=None):
+        user = self._route('user')
+        if id_user:
+            user = user(id_user)
+        return user
+
+    def _group(self, id_group=None):
+        group = self._route('group')
+        if id_group:
+            group = group(id_group)
+        return group
+
+    def _corpus(self, id_corpus=None):
+        corpus = self._route('corpus')
+        if id_corpus:
+            corpus = corpus(id_corpus)
+        return corpus
+
+    def _medium(self, id_medium=None):
+        medium = self._route('medium')
+        if id_medium:
+            medium = medium(id_medium)
+        return medium
+
+    def _layer(self, id_layer=None):
+        layer = self._route('layer')
+        if id_layer:
+            layer = layer(id_layer)
+        return layer
+
+    def _annotation(self, id_annotation=None):
+        annotation = self._route('annotation')
+        if id_annotation:
+            annotation = annotation(id_annotation)
+        return annotation
+
+    def _queue(self, id_queue=None):
+        queue = self._route('queue')
+        if id_queue:
+            queue = queue(id_queue)
+        return queue
+
+    def _id(self, result):
+        if isinstance(result, list):
+            return [r._id for r in result]
+        return result._id
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # AUTHENTICATION
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling(resuscitate=False)
+    async def login(self, username, password=None, keep_alive=False):
+        """Login (see `Camomile.login`)"""
+
+        if password is None:
+            password = getpass()
+
+        credentials = {'username': username,
+                       'password': password}
+
+        result = await self._route('login').post(data=credentials)
+
+        if keep_alive:
+            self._keep_alive = credentials
+
+        self._generation += 1
+
+        return result
+
+    async def _resuscitate(self, generation=None, max_trials=-1):
+        """Try rescuscitating a dead "keep_alive" client
+
+        Parameters
+        ----------
+        generation : int, optional
+            Login generation the failing request was sent with. Nothing is
+            done if another coroutine already logged in again since then.
+        max_trials : int, optional
+            Default to unlimited number of trials.
+        """
+
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+
+        async with self._login_lock:
+
+            if generation is not None and generation != self._generation:
+                return
+
+            # logged out in the meantime
+            if not self._keep_alive:
+                return
+
+            username = self._keep_alive['username']
+            password = self._keep_alive['password']
+
+            trials = 0
+            while trials != max_trials:
+                try:
+                    success = await self.login(username, password=password,
+                                               keep_alive=True)
+                    if success:
+                        break
+                except aiohttp.ClientConnectionError:
+                    trials += 1
+                    wait = 2 ** trials
+                    warning = 'Lost connection. Waiting {wait:d} seconds before trying again...'
+                    warnings.warn(warning.format(wait=wait))
+                    await asyncio.sleep(wait)
+
+    @AsyncCamomileErrorHandling(resuscitate=False)
+    async def logout(self):
+        """Logout (see `Camomile.logout`)"""
+
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+            self._listenerCallbacks = {}
+
+        self._keep_alive = None
+
+        return await self._route('logout').post()
+
+    @AsyncCamomileErrorHandling()
+    async def me(self, returns_id=False):
+        """Get information about logged in user"""
+        result = await self._route('me').get()
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def getMyGroups(self):
+        """Get groups the logged in user belongs to"""
+        return await self._route('me', 'group').get()
+
+    @AsyncCamomileErrorHandling()
+    async def update_password(self, new_password=None):
+        """Update password"""
+
+        if new_password is None:
+            new_password = getpass('New password: ')
+
+        return await self._route('me').put(data={'password': new_password})
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # USERS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getUser(self, user):
+        """Get user by ID (see `Camomile.getUser`)"""
+        return await self._user(user).get()
+
+    @AsyncCamomileErrorHandling()
+    async def getUsers(self, username=None, returns_id=False):
+        """Get user(s) (see `Camomile.getUsers`)"""
+        params = {'username': username} if username else None
+        result = await self._user().get(params=params)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createUser(self,
+                         username, password,
+                         description=None, role='user',
+                         returns_id=False):
+        """Create new user (see `Camomile.createUser`)"""
+
+        data = {'username': username,
+                'password': password,
+                'description': description if description else {},
+                'role': role}
+
+        result = await self._user().post(data=data)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateUser(self, user, password=None, description=None,
+                         role=None):
+        """Update existing user (see `Camomile.updateUser`)"""
+        data = {}
+
+        if password is not None:
+            data['password'] = password
+
+        if description is not None:
+            data['description'] = description
+
+        if role is not None:
+            data['role'] = role
+
+        return await self._user(user).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteUser(self, user):
+        """Delete existing user (see `Camomile.deleteUser`)"""
+        return await self._user(user).delete()
+
+    @AsyncCamomileErrorHandling()
+    async def getUserGroups(self, user):
+        """Get groups of existing user (see `Camomile.getUserGroups`)"""
+        return await self._user(user).group.get()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # GROUPS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getGroup(self, group):
+        """Get group by ID (see `Camomile.getGroup`)"""
+        return await self._group(group).get()
+
+    @AsyncCamomileErrorHandling()
+    async def getGroups(self, name=None, returns_id=False):
+        """Get group(s) (see `Camomile.getGroups`)"""
+        params = {'name': name} if name else None
+        result = await self._group().get(params=params)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createGroup(self, name, description=None, returns_id=False):
+        """Create new group (see `Camomile.createGroup`)"""
+        data = {'name': name,
+                'description': description if description else {}}
+
+        result = await self._group().post(data=data)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateGroup(self, group, description=None):
+        """Update existing group (see `Camomile.updateGroup`)"""
+        data = {'description': description}
+        return await self._group(group).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteGroup(self, group):
+        """Delete existing group (see `Camomile.deleteGroup`)"""
+        return await self._group(group).delete()
+
+    @AsyncCamomileErrorHandling()
+    async def addUserToGroup(self, user, group):
+        return await self._group(group).user(user).put()
+
+    @AsyncCamomileErrorHandling()
+    async def removeUserFromGroup(self, user, group):
+        return await self._group(group).user(user).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # CORPORA
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getCorpus(self, corpus, history=False):
+        """Get corpus by ID (see `Camomile.getCorpus`)"""
+        params = {'history': 'on'} if history else {}
+        return await self._corpus(corpus).get(params=params)
+
+    @AsyncCamomileErrorHandling()
+    async def getCorpora(self, name=None, history=False, returns_id=False):
+        """Get corpora (see `Camomile.getCorpora`)"""
+        params = {'history': 'on'} if history else {}
+        if name:
+            params['name'] = name
+
+        result = await self._corpus().get(params=params)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createCorpus(self, name, description=None, returns_id=False):
+        """Create new corpus (see `Camomile.createCorpus`)"""
+        data = {'name': name,
+                'description': description if description else {}}
+        result = await self._corpus().post(data=data)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateCorpus(self, corpus, name=None, description=None):
+        """Update corpus (see `Camomile.updateCorpus`)"""
+        data = {}
+
+        if name:
+            data['name'] = name
+
+        if description:
+            data['description'] = description
+
+        return await self._corpus(corpus).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteCorpus(self, corpus):
+        """Delete corpus (see `Camomile.deleteCorpus`)"""
+        return await self._corpus(corpus).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # MEDIA
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getMedium(self, medium, history=False):
+        """Get medium by ID (see `Camomile.getMedium`)"""
+        params = {'history': 'on'} if history else {}
+        return await self._medium(medium).get(params=params)
+
+    @AsyncCamomileErrorHandling()
+    async def getMedia(self, corpus=None, name=None, history=False,
+                       returns_id=False, returns_count=False):
+        """Get media (see `Camomile.getMedia`)"""
+
+        params = {'history': 'on'} if history else {}
+        if name:
+            params['name'] = name
+
+        if corpus:
+            # /corpus/:id_corpus/medium
+            route = self._corpus(corpus).medium
+            if returns_count:
+                # /corpus/:id_corpus/medium/count
+                route = route.count
+            result = await route.get(params=params)
+        else:
+            # /medium/count does not exist
+            if returns_count:
+                raise ValueError('returns_count needs a corpus.')
+            result = await self._medium().get(params=params)
+
+        return (self._id(result)
+                if (returns_id and not returns_count)
+                else result)
+
+    @AsyncCamomileErrorHandling()
+    async def createMedium(self, corpus, name, url=None, description=None,
+                           returns_id=False):
+        """Add new medium to corpus (see `Camomile.createMedium`)"""
+        medium = {'name': name,
+                  'url': url if url else '',
+                  'description': description if description else {}}
+
+        result = await self._corpus(corpus).medium.post(data=medium)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createMedia(self, corpus, media, returns_id=False):
+        """Add several media to corpus (see `Camomile.createMedia`)"""
+        result = await self._corpus(corpus).medium.post(data=media)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateMedium(self, medium, name=None, url=None,
+                           description=None):
+        """Update existing medium (see `Camomile.updateMedium`)"""
+        data = {}
+
+        if name is not None:
+            data['name'] = name
+
+        if url is not None:
+            data['url'] = url
+
+        if description is not None:
+            data['description'] = description
+
+        return await self._medium(medium).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteMedium(self, medium):
+        """Delete existing medium (see `Camomile.deleteMedium`)"""
+        return await self._medium(medium).delete()
+
+    @AsyncCamomileErrorHandling()
+    async def streamMedium(self, medium, format=None):
+        """Stream medium (see `Camomile.streamMedium`)
+
+        Returns
+        -------
+        content : bytes
+            Raw medium content.
+        """
+
+        if format is None:
+            format = 'video'
+
+        return await self._medium(medium).get(format, raw=True)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # LAYERS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getLayer(self, layer, history=False):
+        """Get layer by ID (see `Camomile.getLayer`)"""
+        params = {'history': 'on'} if history else {}
+        return await self._layer(layer).get(params=params)
+
+    @AsyncCamomileErrorHandling()
+    async def getLayers(self, corpus=None, name=None,
+                        fragment_type=None, data_type=None,
+                        history=False, returns_id=False):
+        """Get layers (see `Camomile.getLayers`)"""
+
+        params = {'history': 'on'} if history else {}
+
+        if name:
+            params['name'] = name
+
+        if fragment_type:
+            params['fragment_type'] = fragment_type
+
+        if data_type:
+            params['data_type'] = data_type
+
+        if corpus:
+            result = await self._corpus(corpus).layer.get(params=params)
+        else:
+            result = await self._layer().get(params=params)
+
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createLayer(self, corpus,
+                          name, description=None,
+                          fragment_type=None, data_type=None,
+                          annotations=None, returns_id=False):
+        """Add new layer to corpus (see `Camomile.createLayer`)"""
+        layer = {'name': name,
+                 'fragment_type': fragment_type if fragment_type else {},
+                 'data_type': data_type if data_type else {},
+                 'description': description if description else {},
+                 'annotations': annotations if annotations else []}
+
+        result = await self._corpus(corpus).layer.post(data=layer)
+
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateLayer(self, layer,
+                          name=None, description=None,
+                          fragment_type=None, data_type=None):
+        """Update existing layer (see `Camomile.updateLayer`)"""
+        data = {}
+
+        if name is not None:
+            data['name'] = name
+
+        if description is not None:
+            data['description'] = description
+
+        if fragment_type is not None:
+            data['fragment_type'] = fragment_type
+
+        if data_type is not None:
+            data['data_type'] = data_type
+
+        return await self._layer(layer).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteLayer(self, layer):
+        """Delete layer (see `Camomile.deleteLayer`)"""
+        return await self._layer(layer).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # ANNOTATIONS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getAnnotation(self, annotation, history=False):
+        """Get annotation by ID (see `Camomile.getAnnotation`)"""
+        params = {'history': 'on'} if history else {}
+        return await self._annotation(annotation).get(params=params)
+
+    @AsyncCamomileErrorHandling()
+    async def getAnnotations(self, layer=None, medium=None,
+                             fragment=None, data=None,
+                             history=False, returns_id=False,
+                             returns_count=False):
+        """Get annotations (see `Camomile.getAnnotations`)"""
+
+        params = {'history': 'on'} if history else {}
+        if medium:
+            params['id_medium'] = medium
+        if fragment:
+            params['fragment'] = fragment
+        if data:
+            params['data'] = data
+
+        if layer:
+            # /layer/:id_layer/annotation
+            route = self._layer(layer).annotation
+            if returns_count:
+                # /layer/:id_layer/annotation/count
+                route = route.count
+            result = await route.get(params=params)
+
+        else:
+            # admin user only
+            if returns_count:
+                # /annotation/count does not exist
+                raise ValueError('returns_count needs a layer')
+            result = await self._annotation().get(params=params)
+
+        return (self._id(result)
+                if (returns_id and not returns_count)
+                else result)
+
+    @AsyncCamomileErrorHandling()
+    async def createAnnotation(self, layer, medium=None, fragment=None,
+                               data=None, returns_id=False):
+        """Create new annotation (see `Camomile.createAnnotation`)"""
+        annotation = {'id_medium': medium,
+                      'fragment': fragment if fragment else {},
+                      'data': data if data else {}}
+
+        result = await self._layer(layer).annotation.post(data=annotation)
+
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createAnnotations(self, layer, annotations, returns_id=False):
+        """Create several annotations (see `Camomile.createAnnotations`)"""
+        result = await self._layer(layer).annotation.post(data=annotations)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateAnnotation(self, annotation, fragment=None, data=None):
+        """Update existing annotation (see `Camomile.updateAnnotation`)"""
+        _data = {}
+
+        if fragment is not None:
+            _data['fragment'] = fragment
+
+        if data is not None:
+            _data['data'] = data
+
+        return await self._annotation(annotation).put(data=_data)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteAnnotation(self, annotation):
+        """Delete existing annotation (see `Camomile.deleteAnnotation`)"""
+        return await self._annotation(annotation).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # QUEUES
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getQueue(self, queue):
+        """Get queue by ID (see `Camomile.getQueue`)"""
+        return await self._queue(queue).get()
+
+    @AsyncCamomileErrorHandling()
+    async def getQueues(self, name=None, returns_id=False):
+        """Get queues (see `Camomile.getQueues`)"""
+
+        params = {'name': name} if name else {}
+
+        result = await self._queue().get(params=params)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def createQueue(self, name, description=None, returns_id=False):
+        """Create queue (see `Camomile.createQueue`)"""
+        data = {'name': name, 'description': description}
+        result = await self._queue().post(data=data)
+        return self._id(result) if returns_id else result
+
+    @AsyncCamomileErrorHandling()
+    async def updateQueue(self, queue, name=None, description=None,
+                          elements=None):
+        """Update queue (see `Camomile.updateQueue`)"""
+        data = {}
+
+        if name is not None:
+            data['name'] = name
+
+        if description is not None:
+            data['description'] = description
+
+        if elements is not None:
+            data['list'] = elements
+
+        return await self._queue(queue).put(data=data)
+
+    @AsyncCamomileErrorHandling()
+    async def enqueue(self, queue, elements):
+        """Enqueue elements (see `Camomile.enqueue`)"""
+
+        if not isinstance(elements, list):
+            elements = [elements]
+
+        return await self._queue(queue).next.put(data=elements)
+
+    @AsyncCamomileErrorHandling()
+    async def dequeue(self, queue):
+        """Dequeue element (see `Camomile.dequeue`)"""
+        return await self._queue(queue).next.get()
+
+    @AsyncCamomileErrorHandling()
+    async def pick(self, queue):
+        """(Non-destructively) pick first element of queue"""
+        return await self._queue(queue).first.get()
+
+    @AsyncCamomileErrorHandling()
+    async def pickAll(self, queue):
+        """(Non-destructively) pick all elements of queue"""
+        return await self._queue(queue).all.get()
+
+    @AsyncCamomileErrorHandling()
+    async def pickLength(self, queue):
+        """(Non-destructively) get number of elements in queue"""
+        return await self._queue(queue).length.get()
+
+    @AsyncCamomileErrorHandling()
+    async def deleteQueue(self, queue):
+        """Delete existing queue (see `Camomile.deleteQueue`)"""
+        return await self._queue(queue).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # RIGHTS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    async def __setPermissions(self, resource, permission, user=None,
+                               group=None):
+
+        if user is None and group is None:
+            raise ValueError('')
+
+        data = {'right': permission}
+
+        if user:
+            await resource.user(user).put(data=data)
+
+        if group:
+            await resource.group(group).put(data=data)
+
+        return await resource.permissions.get()
+
+    async def __removePermissions(self, resource, user=None, group=None):
+
+        if user is None and group is None:
+            raise ValueError('')
+
+        if user:
+            await resource.user(user).delete()
+
+        if group:
+            await resource.group(group).delete()
+
+        return await resource.permissions.get()
+
+    # on a corpus
+
+    @AsyncCamomileErrorHandling()
+    async def getCorpusPermissions(self, corpus):
+        """Get permissions on existing corpus"""
+        return await self._corpus(corpus).permissions.get()
+
+    @AsyncCamomileErrorHandling()
+    async def setCorpusPermissions(self, corpus, permission, user=None,
+                                   group=None):
+        """Update permissions on a corpus"""
+        return await self.__setPermissions(
+            self._corpus(corpus), permission, user=user, group=group)
+
+    @AsyncCamomileErrorHandling()
+    async def removeCorpusPermissions(self, corpus, user=None, group=None):
+        """Remove permissions on a corpus"""
+        return await self.__removePermissions(
+            self._corpus(corpus), user=user, group=group)
+
+    # on a layer
+
+    @AsyncCamomileErrorHandling()
+    async def getLayerPermissions(self, layer):
+        """Get permissions on existing layer"""
+        return await self._layer(layer).permissions.get()
+
+    @AsyncCamomileErrorHandling()
+    async def setLayerPermissions(self, layer, permission, user=None,
+                                  group=None):
+        """Update rights on a layer"""
+        return await self.__setPermissions(
+            self._layer(layer), permission, user=user, group=group)
+
+    @AsyncCamomileErrorHandling()
+    async def removeLayerPermissions(self, layer, user=None, group=None):
+        """Remove permissions on a layer"""
+        return await self.__removePermissions(
+            self._layer(layer), user=user, group=group)
+
+    # on a queue
+
+    @AsyncCamomileErrorHandling()
+    async def getQueuePermissions(self, queue):
+        """Get permissions on existing queue"""
+        return await self._queue(queue).permissions.get()
+
+    @AsyncCamomileErrorHandling()
+    async def setQueuePermissions(self, queue, permission, user=None,
+                                  group=None):
+        """Update permissions on a queue"""
+        return await self.__setPermissions(
+            self._queue(queue), permission, user=user, group=group)
+
+    @AsyncCamomileErrorHandling()
+    async def removeQueuePermissions(self, queue, user=None, group=None):
+        """Remove permissions on a queue"""
+        return await self.__removePermissions(
+            self._queue(queue), user=user, group=group)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # METADATA (Corpus, Layer, Medium)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    #
+    # CORPUS
+
+    @AsyncCamomileErrorHandling()
+    async def getCorpusMetadata(self, corpus, path=None, file=False):
+        """Get corpus metadata"""
+        return await self.__getMetadata(self._corpus(corpus), path=path,
+                                        file=file)
+
+    @AsyncCamomileErrorHandling()
+    async def getCorpusMetadataKeys(self, corpus, path=None):
+        """Get corpus metadata keys at 'path'"""
+        return await self.__getMetadataKeys(self._corpus(corpus), path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def setCorpusMetadata(self, corpus, metadata, path=None):
+        """Set Corpus metadatas"""
+        return await self.__setMetadata(self._corpus(corpus), metadata,
+                                        path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def sendCorpusMetadataFile(self, corpus, path, filepath):
+        """Send corpus metadata file"""
+        return await self.__sendMetadataFile(self._corpus(corpus), path,
+                                             filepath)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteCorpusMetadata(self, corpus, path):
+        """Delete Corpus metadatas"""
+        return await self.__deleteMetadata(self._corpus(corpus), path)
+
+    #
+    # LAYER
+
+    @AsyncCamomileErrorHandling()
+    async def getLayerMetadata(self, layer, path=None, file=False):
+        """Get layer metadata"""
+        return await self.__getMetadata(self._layer(layer), path=path,
+                                        file=file)
+
+    @AsyncCamomileErrorHandling()
+    async def getLayerMetadataKeys(self, layer, path=None):
+        """Get layer metadata keys at 'path'"""
+        return await self.__getMetadataKeys(self._layer(layer), path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def setLayerMetadata(self, layer, metadata, path=None):
+        """Set Layer metadatas"""
+        return await self.__setMetadata(self._layer(layer), metadata,
+                                        path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def sendLayerMetadataFile(self, layer, path, filepath):
+        """Send layer metadata file"""
+        return await self.__sendMetadataFile(self._layer(layer), path,
+                                             filepath)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteLayerMetadata(self, layer, path):
+        """Delete Layer metadatas"""
+        return await self.__deleteMetadata(self._layer(layer), path)
+
+    #
+    # MEDIUM
+
+    @AsyncCamomileErrorHandling()
+    async def getMediumMetadata(self, medium, path=None, file=False):
+        """Get medium metadata"""
+        return await self.__getMetadata(self._medium(medium), path=path,
+                                        file=file)
+
+    @AsyncCamomileErrorHandling()
+    async def getMediumMetadataKeys(self, medium, path=None):
+        """Get medium metadata keys at 'path'"""
+        return await self.__getMetadataKeys(self._medium(medium), path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def setMediumMetadata(self, medium, metadata, path=None):
+        """Set Medium metadatas"""
+        return await self.__setMetadata(self._medium(medium), metadata,
+                                        path=path)
+
+    @AsyncCamomileErrorHandling()
+    async def sendMediumMetadataFile(self, medium, path, filepath):
+        """Send medium metadata file"""
+        return await self.__sendMetadataFile(self._medium(medium), path,
+                                             filepath)
+
+    @AsyncCamomileErrorHandling()
+    async def deleteMediumMetadata(self, medium, path):
+        """Delete Medium metadatas"""
+        return await self.__deleteMetadata(self._medium(medium), path)
+
+    async def __getMetadata(self, resource, path=None, file=False):
+
+        if path is None:
+            metadata = await resource.metadata.get()
+        else:
+            metadata = await resource.metadata(path).get()
+
+        if file:
+            metadata = b64decode(metadata['data']).decode()
+
+        return metadata
+
+    async def __getMetadataKeys(self, resource, path=None):
+
+        if path is None:
+            return await resource.metadata.get()
+
+        return await resource.metadata(path + '.').get()
+
+    async def __setMetadata(self, resource, metadata, path=None):
+
+        if path is None:
+            return await resource.metadata.post(data=metadata)
+
+        data = {}
+        pointer = data
+        tokens = path.split('.')
+        for i in tokens[:-1]:
+            pointer[i] = {}
+            pointer = pointer[i]
+        pointer[tokens[-1]] = metadata
+
+        return await resource.metadata.post(data=data)
+
+    async def __sendMetadataFile(self, resource, metadata_path, file_path):
+
+        def read():
+            with open(file_path, 'rb') as f:
+                return f.read()
+
+        # do not block the event loop while reading the file
+        loop = asyncio.get_event_loop()
+        content = await loop.run_in_executor(None, read)
+
+        data = {}
+        pointer = data
+        for i in metadata_path.split('.'):
+            pointer[i] = {}
+            pointer = pointer[i]
+
+        pointer['type'] = 'file'
+        pointer['filename'] = os.path.basename(file_path)
+        pointer['data'] = b64encode(content).decode()
+
+        return await resource.metadata.post(data=data)
+
+    async def __deleteMetadata(self, resource, path):
+        return await resource.metadata(path).delete()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # SSE
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def __startListener(self):
+        if self._listener is None:
+            datas = await self._route('listen').post()
+            self._channel_id = datas.channel_id
+            self._listener = asyncio.ensure_future(self.__listener())
+
+    async def __listener(self):
+
+        # server-sent events stream may stay idle for a long time
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=self._timeout.sock_connect)
+
+        # delay before reconnecting, doubled after each failure
+        delay = 1.
+
+        while True:
+
+            reopen = False
+
+            try:
+                url = '{url}/listen/{channel}'.format(
+                    url=self._url, channel=self._channel_id)
+                session = self._getSession()
+                async with session.get(url, timeout=timeout) as response:
+
+                    if response.status >= 400:
+                        # channel is gone (e.g. server restarted)
+                        reopen = True
+
+                    else:
+                        event, data = 'message', []
+                        async for line in response.content:
+                            line = line.decode('utf-8').rstrip('\r\n')
+
+                            # empty line dispatches the event
+                            if not line:
+                                if data:
+                                    await self.__dispatch(event,
+                                                          '\n'.join(data))
+                                    delay = 1.
+                                event, data = 'message', []
+
+                            elif line.startswith(':'):
+                                continue
+
+                            else:
+                                field, _, value = line.partition(':')
+                                value = value[1:] if value[:1] == ' ' else value
+                                if field == 'event':
+                                    event = value
+                                elif field == 'data':
+                                    data.append(value)
+
+            except asyncio.CancelledError:
+                raise
+
+            except aiohttp.ClientError:
+                pass
+
+            # back off before reconnecting, whatever ended the stream
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 60.)
+
+            if reopen:
+                try:
+                    await self.__reopenChannel()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    warnings.warn(
+                        'Could not open a new channel: {e}'.format(e=e))
+
+    async def __reopenChannel(self):
+        # open a new channel and watch the same resources again
+        datas = await self._route('listen').post()
+        self._channel_id = datas.channel_id
+        for key in list(self._listenerCallbacks):
+            kind, id_ = key.split(':', 1)
+            await self._route('listen', self._channel_id, kind, id_).put()
+
+    async def __dispatch(self, event, data):
+        # copy as callbacks may be (un)registered meanwhile
+        callbacks = list(self._listenerCallbacks.get(event, []))
+        for callback in callbacks:
+            # a failing callback must not stop the listener (and every
+            # following event with it)
+            try:
+                result = callback(json.loads(data)['event'])
+                if asyncio.iscoroutine(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                warnings.warn('Callback watching {event} failed: {e}'.format(
+                    event=event, e=e))
+
+    async def __watch(self, kind, id_, callback):
+        await self.__startListener()
+        result = await self._route('listen', self._channel_id, kind, id_).put()
+        if 'event' in result:
+            callbacks = self._listenerCallbacks.setdefault(kind + ':' + id_,
+                                                           [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+        return result
+
+    async def __unwatch(self, kind, id_, callback=None):
+        key = kind + ':' + id_
+        callbacks = self._listenerCallbacks.get(key, [])
+
+        if callback is not None and callback not in callbacks:
+            raise CamomileNotFound(
+                'Callback is not watching {kind} {id_}.'.format(
+                    kind=kind, id_=id_))
+
+        if callback is not None and len(callbacks) > 1:
+            # keep watching for remaining callbacks
+            callbacks.remove(callback)
+            return {'success': 'callback removed'}
+
+        result = await self._route(
+            'listen', self._channel_id, kind, id_).delete()
+        if 'success' in result:
+            self._listenerCallbacks.pop(key, None)
+        return result
+
+    @AsyncCamomileErrorHandling()
+    async def watchCorpus(self, corpus_id, callback):
+        """Watch corpus (see `Camomile.watchCorpus`)
+
+        `callback` may either be a function or a coroutine function.
+        Several callbacks may watch the same resource.
+        """
+        return await self.__watch('corpus', corpus_id, callback)
+
+    @AsyncCamomileErrorHandling()
+    async def unwatchCorpus(self, corpus_id, callback=None):
+        """UnWatch corpus (see `Camomile.unwatchCorpus`)"""
+        return await self.__unwatch('corpus', corpus_id, callback=callback)
+
+    @AsyncCamomileErrorHandling()
+    async def watchLayer(self, layer_id, callback):
+        """Watch layer (see `Camomile.watchLayer`)
+
+        `callback` may either be a function or a coroutine function.
+        Several callbacks may watch the same resource.
+        """
+        return await self.__watch('layer', layer_id, callback)
+
+    @AsyncCamomileErrorHandling()
+    async def unwatchLayer(self, layer_id, callback=None):
+        """UnWatch layer (see `Camomile.unwatchLayer`)"""
+        return await self.__unwatch('layer', layer_id, callback=callback)
+
+    @AsyncCamomileErrorHandling()
+    async def watchMedium(self, medium_id, callback):
+        """Watch medium (see `Camomile.watchMedium`)
+
+        `callback` may either be a function or a coroutine function.
+        Several callbacks may watch the same resource.
+        """
+        return await self.__watch('medium', medium_id, callback)
+
+    @AsyncCamomileErrorHandling()
+    async def unwatchMedium(self, medium_id, callback=None):
+        """UnWatch medium (see `Camomile.unwatchMedium`)"""
+        return await self.__unwatch('medium', medium_id, callback=callback)
+
+    @AsyncCamomileErrorHandling()
+    async def watchQueue(self, queue_id, callback):
+        """Watch queue (see `Camomile.watchQueue`)
+
+        `callback` may either be a function or a coroutine function.
+        Several callbacks may watch the same resource.
+        """
+        return await self.__watch('queue', queue_id, callback)
+
+    @AsyncCamomileErrorHandling()
+    async def unwatchQueue(self, queue_id, callback=None):
+        """UnWatch queue (see `Camomile.unwatchQueue`)"""
+        return await self.__unwatch('queue', queue_id, callback=callback)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # UTILS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @AsyncCamomileErrorHandling()
+    async def getDate(self):
+        return await self._route('date').get()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Helpers for bulk (chunked, concurrent) requests"""
+
+import collections
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def chunks(iterable, size):
+    """Split `iterable` into lists of (at most) `size` consecutive items
+
+    Parameters
+    ----------
+    iterable : iterable
+        Any iterable (including generators).
+    size : int
+        Chunk size.
+
+    Returns
+    -------
+    chunks : iterator
+        Iterator over lists of items.
+    """
+
+    if size < 1:
+        raise ValueError('Chunk size must be strictly positive.')
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _should_retry(exception, retry_on):
+    if isinstance(retry_on, (tuple, type)):
+        return isinstance(exception, retry_on)
+    return retry_on(exception)
+
+
+def retry(func, max_retries=0, retry_on=(Exception,), retry_delay=1.):
+    """Wrap `func` so that it is called again when it fails
+
+    Parameters
+    ----------
+    func : callable
+    max_retries : int, optional
+        Maximum number of retries.  Defaults to 0 (no retry).
+    retry_on : tuple of exception classes or callable, optional
+        Only retry on these exceptions, or on exceptions for which
+        `retry_on(exception)` is True.  Defaults to any exception.
+    retry_delay : float, optional
+        Wait `retry_delay` seconds before first retry, and twice as much
+        before each following retry.  Defaults to 1 second.
+    """
+
+    def wrapped(*args, **kwargs):
+        trial = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if trial >= max_retries or not _should_retry(e, retry_on):
+                    raise
+            time.sleep(retry_delay * 2 ** trial)
+            trial += 1
+
+    return wrapped
+
+
+def parallel_imap(func, items, max_workers=4, max_retries=0,
+                  retry_on=(Exception,), retry_delay=1.,
+                  return_exceptions=False):
+    """Concurrently apply `func` to each item of `items`, in order
+
+    Only a bounded number of items are consumed from `items` ahead of the
+    results, so that `items` may be an arbitrarily long generator.
+
+    Parameters
+    ----------
+    func : callable
+        Function of one item.
+    items : iterable
+    max_workers : int, optional
+        Maximum number of concurrent calls.  Defaults to 4.
+    max_retries, retry_on, retry_delay : optional
+        See `retry`.
+    return_exceptions : boolean, optional
+        When True, exceptions raised by `func` (once all retries failed) are
+        yielded in place of the corresponding results.  Defaults to False,
+        i.e. the first exception is raised and remaining calls are cancelled.
+
+    Returns
+    -------
+    results : iterator
+        Iterator over results, in the same order as `items`.
+    """
+
+    func = retry(func, max_retries=max_retries, retry_on=retry_on,
+                 retry_delay=retry_delay)
+
+    window = 2 * max_workers
+    pending = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) < window:
+                    continue
+                yield _result(pending.popleft(), return_exceptions)
+
+            while pending:
+                yield _result(pending.popleft(), return_exceptions)
+
+        finally:
+            # stop as soon as possible on failure (or early exit)
+            for future in pending:
+                future.cancel()
+
+
+def parallel_imap_unordered(func, items, max_workers=4, max_retries=0,
+                            retry_on=(Exception,), retry_delay=1.,
+                            return_exceptions=False):
+    """Concurrently apply `func` to each item of `items`, as completed
+
+    Same as `parallel_imap` except that (item, result) pairs are yielded as
+    soon as results are available, whatever the order of `items`.
+    """
+
+    func = retry(func, max_retries=max_retries, retry_on=retry_on,
+                 retry_delay=retry_delay)
+
+    window = 2 * max_workers
+    items = iter(items)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        try:
+            while True:
+
+                for item in itertools.islice(items, window - len(pending)):
+                    pending[executor.submit(func, item)] = item
+
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    yield item, _result(future, return_exceptions)
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _result(future, return_exceptions):
+    try:
+        return future.result()
+    except Exception as e:
+        if return_exceptions:
+            return e
+        raise
+
+
+def parallel_map(func, items, **kwargs):
+    """Same as `parallel_imap` but returns a list"""
+    return list(parallel_imap(func, items, **kwargs))
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Client-side caches of annotations, layers and metadata"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class AnnotationCache(object):
+    """Persistent cache of `getAnnotations` and `getLayers` results
+
+    Results are stored in a local SQLite file, keyed by resource and query
+    parameters, so that they survive the process (e.g. re-running a batch
+    job costs local reads instead of full layer downloads).
+
+    Cached results are invalidated by changes made through the client, by
+    server-sent events (when `watch` is True), and after `ttl` seconds
+    anyway -- as changes made by other clients would go unnoticed
+    otherwise.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to SQLite file.  Defaults to ~/.camomile/cache.sqlite.
+    ttl : float, optional
+        Time to live of cached results, in seconds.  Defaults to one day.
+        Set to None to never expire.
+    watch : boolean, optional
+        Whether the client should watch cached layers and corpora for
+        changes made by other clients.  Defaults to False.
+
+    Example
+    -------
+    >>> client = Camomile(url, cache=AnnotationCache(ttl=3600))
+    >>> client.login(username, password)
+    >>> annotations = client.getAnnotations(layer)  # downloaded
+    >>> annotations = client.getAnnotations(layer)  # read from disk
+    """
+
+    def __init__(self, path=None, ttl=86400., watch=False):
+        super(AnnotationCache, self).__init__()
+
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.camomile',
+                                'cache.sqlite')
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self.ttl = ttl
+        self.watch = watch
+
+        # one connection shared by all threads (hence the lock), in
+        # autocommit mode
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False,
+                                           isolation_level=None)
+        with self._lock:
+            # let several processes read while one is writing
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, kind TEXT, id TEXT, '
+                'value TEXT, time REAL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS cache_resource '
+                'ON cache (kind, id)')
+
+        # incremented at each invalidation, so that results fetched while
+        # being invalidated are not stored
+        self._version = 0
+
+    @staticmethod
+    def key(*args):
+        """Build cache key from (JSON-serializable) arguments"""
+        return json.dumps(args, sort_keys=True, separators=(',', ':'))
+
+    def version(self):
+        """Get current version (to be passed to `set`)"""
+        return self._version
+
+    def get(self, key):
+        """Get cached value (None if missing or expired)"""
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, time FROM cache WHERE key = ?',
+                (key, )).fetchone()
+
+        if row is None:
+            return None
+
+        value, timestamp = row
+        if self.ttl is not None and time.time() - timestamp > self.ttl:
+            with self._lock:
+                self._connection.execute('DELETE FROM cache WHERE key = ?',
+                                         (key, ))
+            return None
+
+        return json.loads(value)
+
+    def set(self, key, kind, id_, value, version=None):
+        """Store value
+
+        Parameters
+        ----------
+        key : str
+            See `key`.
+        kind, id_ : str
+            Resource the value depends on (e.g. 'layer' and layer ID).
+        value :
+            JSON-serializable value.
+        version : int, optional
+            Value of `version()` before `value` was fetched.  Nothing is
+            stored when the cache was invalidated since then.
+        """
+
+        value = json.dumps(value, separators=(',', ':'))
+
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._connection.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                (key, kind, id_ or '', value, time.time()))
+
+    def invalidate(self, kind=None, id_=None):
+        """Invalidate cached values
+
+        Parameters
+        ----------
+        kind : str, optional
+            Only invalidate values depending on this kind of resources.
+        id_ : str, optional
+            Only invalidate values depending on this resource.
+        """
+
+        with self._lock:
+            self._version += 1
+            if kind is None:
+                self._connection.execute('DELETE FROM cache')
+            elif id_ is None:
+                self._connection.execute('DELETE FROM cache WHERE kind = ?',
+                                         (kind, ))
+            else:
+                self._connection.execute(
+                    'DELETE FROM cache WHERE kind = ? AND id = ?',
+                    (kind, id_))
+
+    def clear(self):
+        """Invalidate all cached values"""
+        self.invalidate()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def on_event(self, kind, id_, event):
+        """Invalidate values affected by a change
+
+        Parameters
+        ----------
+        kind : str
+            Resource type (e.g. 'layer').
+        id_ : str
+            Resource ID.  None when unknown.
+        event : dict
+            e.g. {'add_annotation': annotation}
+        """
+
+        if kind == 'listener':
+            # server-sent events may have been missed
+            if event.get('reconnect', False):
+                self.invalidate()
+            return
+
+        if kind == 'corpus':
+            self.invalidate('corpus', id_)
+            # values not specific to one corpus (e.g. `getLayers()` of all
+            # corpora) are stored with an empty ID
+            if id_:
+                self.invalidate('corpus', '')
+            if 'delete_layer' in event:
+                self.invalidate('layer', event['delete_layer'])
+            return
+
+        if kind != 'layer':
+            return
+
+        self.invalidate('layer', id_)
+
+        # layer attributes are part of `getLayers` results
+        if any(not name.endswith('_annotation') for name in event):
+            self.invalidate('corpus')
+
+
+def _tokens(path):
+    return () if path is None else tuple(path.split('.'))
+
+
+class MetadataCache(object):
+    """In-memory cache of metadata trees
+
+    Metadata subtrees (and lists of keys) fetched from the server are kept
+    per resource, so that reading any path below an already fetched path is
+    answered locally.  Writing or deleting a path only invalidates cached
+    subtrees containing it or contained in it.
+
+    Only changes made through the same client are taken into account.
+    """
+
+    def __init__(self):
+        super(MetadataCache, self).__init__()
+        self._lock = threading.Lock()
+        # resource --> {path tokens --> subtree}
+        self._trees = {}
+        # resource --> {path tokens --> keys}
+        self._keys = {}
+        # resource --> number of invalidations
+        self._versions = {}
+
+    def version(self, resource):
+        """Get current version of resource (to be passed to `set`)"""
+        return self._versions.get(resource, 0)
+
+    def get(self, resource, path):
+        """Get cached metadata (raises KeyError when not cached)"""
+
+        tokens = _tokens(path)
+
+        with self._lock:
+            trees = self._trees.get(resource, {})
+            # look for the closest cached ancestor
+            for i in range(len(tokens), 0, -1):
+                tree = trees.get(tokens[:i], None)
+                if tree is None:
+                    continue
+                for token in tokens[i:]:
+                    if not isinstance(tree, dict) or token not in tree:
+                        # let the server answer (e.g. 404)
+                        raise KeyError(path)
+                    tree = tree[token]
+                return copy.deepcopy(tree)
+
+        raise KeyError(path)
+
+    def keys(self, resource, path):
+        """Get cached list of keys (raises KeyError when not cached)"""
+
+        tokens = _tokens(path)
+
+        with self._lock:
+            keys = self._keys.get(resource, {}).get(tokens, None)
+            if keys is not None:
+                return list(keys)
+
+        tree = self.get(resource, path) if tokens else None
+        if not isinstance(tree, dict):
+            raise KeyError(path)
+        return list(tree)
+
+    def set(self, resource, path, metadata, version=None):
+        """Store metadata fetched with `version` (see `version`)"""
+        with self._lock:
+            if version is None or version == self.version(resource):
+                self._trees.setdefault(resource, {})[_tokens(path)] = \
+                    copy.deepcopy(metadata)
+
+    def set_keys(self, resource, path, keys, version=None):
+        """Store list of keys fetched with `version` (see `version`)"""
+        with self._lock:
+            if version is None or version == self.version(resource):
+                self._keys.setdefault(resource, {})[_tokens(path)] = \
+                    list(keys)
+
+    def invalidate(self, resource, paths=None):
+        """Invalidate cached metadata affected by a change of `paths`
+
+        Parameters
+        ----------
+        resource : str
+        paths : iterable, optional
+            Modified paths.  Defaults to invalidating the whole resource.
+        """
+
+        with self._lock:
+
+            self._versions[resource] = self.version(resource) + 1
+
+            if paths is None:
+                self._trees.pop(resource, None)
+                self._keys.pop(resource, None)
+                return
+
+            paths = [_tokens(path) for path in paths]
+
+            def affected(cached):
+                for modified in paths:
+                    # one contains the other
+                    n = min(len(cached), len(modified))
+                    if cached[:n] == modified[:n]:
+                        return True
+                return False
+
+            for cache in (self._trees, self._keys):
+                cache = cache.get(resource, {})
+                for cached in [c for c in cache if affected(c)]:
+                    del cache[cached]
+
+    def clear(self):
+        with self._lock:
+            self._trees, self._keys = {}, {}
+            for resource in self._versions:
+                self._versions[resource] += 1
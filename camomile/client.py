@@ -32,16 +32,30 @@
 
 
 import tortilla
+from tortilla.utils import bunchify
 import requests
-import os
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import socket
 import threading
+import weakref
 import json
-from base64 import b64encode, b64decode
+from base64 import b64decode
 from getpass import getpass
 from sseclient import SSEClient
 import warnings
 import time
 
+from .bulk import chunks, parallel_imap, parallel_imap_unordered, \
+                  parallel_map
+from .stream import iter_text, iter_json_array, iter_metadata_file, \
+    write_metadata_file
+from .columnar import AnnotationArray
+from .index import IntervalIndex
+from .cache import AnnotationCache, MetadataCache
+from .export import guess_format, export
+from .media import download, _replace
+
 
 class CamomileBadRequest(Exception):
     pass
@@ -67,6 +81,44 @@ class CamomileBadJSON(Exception):
     pass
 
 
+# errors worth retrying an idempotent bulk request (GET, PUT, DELETE) for
+RETRIABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    CamomileInternalError,
+)
+
+
+def is_unsent(error):
+    """Check whether `error` was raised before the request was sent
+
+    Only such errors are worth retrying a non-idempotent request (e.g.
+    creation) for: after any other connection error, a read timeout or an
+    internal error, the server may already have applied the request, which
+    would then be applied twice.
+    """
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+
+    if isinstance(error, requests.exceptions.ConnectionError):
+        # connection could not be established (e.g. refused, unknown host)
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    return False
+
+
+# HTTP status code to Camomile exception
+CAMOMILE_EXCEPTIONS = {
+    400: CamomileBadRequest,
+    401: CamomileUnauthorized,
+    403: CamomileForbidden,
+    404: CamomileNotFound,
+    500: CamomileInternalError,
+}
+
+
 class CamomileErrorHandling(object):
     """Decorator for handling Camomile errors as exceptions
 
@@ -79,22 +131,32 @@ class CamomileErrorHandling(object):
         automatically try to relogging on connection or authentication errors.
         Note that `rescucitate` must be set to False for login/logout methods
         as setting it to rue would result in an infinite login loop...
+        When several threads fail at the same time, only one of them actually
+        logs in again while the other ones wait for it.
+    resend : boolean, optional
+        Set `resend` to False for non-idempotent requests, so that they are
+        only sent again after connection errors raised before they were sent
+        in the first place (see `is_unsent`).
 
     """
 
-    def __init__(self, resuscitate=True):
+    def __init__(self, resuscitate=True, resend=True):
         super(CamomileErrorHandling, self).__init__()
         self.resuscitate = resuscitate
+        self.resend = resend
 
     def __call__(self, func, *args, **kwargs):
         def decorated_method(client, *args, **kwargs):
+            # login generation this request is sent with
+            generation = client._generation
             try:
                 return func(client, *args, **kwargs)
 
             # (optionnally) resuscitate in case of connection error
             except requests.exceptions.ConnectionError as e:
-                if self.resuscitate and client._keep_alive:
-                    client._resuscitate(max_trials=-1)
+                if self.resuscitate and client._keep_alive and \
+                        (self.resend or is_unsent(e)):
+                    client._resuscitate(max_trials=-1, generation=generation)
                     return func(client, *args, **kwargs)
 
                 raise e
@@ -118,24 +180,14 @@ class CamomileErrorHandling(object):
 
                 status_code = e.response.status_code
 
-                if status_code == 400:
-                    raise CamomileBadRequest(message)
-
                 if status_code == 401:
                     if self.resuscitate and client._keep_alive:
-                        client._resuscitate(max_trials=-1)
+                        client._resuscitate(max_trials=-1,
+                                            generation=generation)
                         return func(client, *args, **kwargs)
-                    else:
-                        raise CamomileUnauthorized(message)
-
-                if status_code == 403:
-                    raise CamomileForbidden(message)
-
-                if status_code == 404:
-                    raise CamomileNotFound(message)
 
-                if status_code == 500:
-                    raise CamomileInternalError(message)
+                if status_code in CAMOMILE_EXCEPTIONS:
+                    raise CAMOMILE_EXCEPTIONS[status_code](message)
 
                 raise e
 
@@ -146,6 +198,101 @@ class CamomileErrorHandling(object):
         return decorated_method
 
 
+class _TunedHTTPAdapter(HTTPAdapter):
+    """HTTP adapter passing custom socket options to its connection pools"""
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super(_TunedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        return super(_TunedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        return super(_TunedHTTPAdapter, self).proxy_manager_for(*args, **kwargs)
+
+
+class CamomileTransport(requests.Session):
+    """HTTP transport shared by all routes of a Camomile client
+
+    This is a `requests.Session` with tunable connection pooling, timeouts
+    and TCP options. Any `requests.Session` (sub)class can be used instead.
+
+    Parameters
+    ----------
+    pool_connections : int, optional
+        Number of per-host connection pools to keep.  Defaults to 10.
+    pool_maxsize : int, optional
+        Maximum number of connections kept open per host.  Defaults to 10.
+    pool_block : boolean, optional
+        When True, wait for a free pooled connection rather than opening an
+        extra (non-reusable) one.  Defaults to False.
+    timeout : float or (float, float) tuple, optional
+        Default socket timeout, or (connect, read) timeouts, in seconds.
+        Defaults to (10, 300).  Use None to wait forever.
+    reuse_connections : boolean, optional
+        Keep connections alive between requests.  Defaults to True.
+    tcp_nodelay : boolean, optional
+        Disable Nagle's algorithm.  Defaults to True.
+    tcp_keepalive : int, optional
+        Enable TCP keep-alive probes after `tcp_keepalive` idle seconds, so
+        that half-dead connections get detected.  Defaults to 60.  Use None
+        to rely on system defaults.
+    max_retries : int, optional
+        Number of retries on connection failures.  Defaults to 0.
+
+    Example
+    -------
+    >>> transport = CamomileTransport(pool_maxsize=32, timeout=(5, 60))
+    >>> client = Camomile(url, transport=transport)
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, timeout=(10, 300), reuse_connections=True,
+                 tcp_nodelay=True, tcp_keepalive=60, max_retries=0):
+        super(CamomileTransport, self).__init__()
+
+        self.timeout = timeout
+
+        if not reuse_connections:
+            self.headers['Connection'] = 'close'
+
+        adapter = _TunedHTTPAdapter(
+            socket_options=self._socket_options(tcp_nodelay, tcp_keepalive),
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block, max_retries=max_retries)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    @staticmethod
+    def _socket_options(tcp_nodelay, tcp_keepalive):
+
+        options = []
+
+        if tcp_nodelay:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+
+        if tcp_keepalive is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            # fine-grained keep-alive tuning is not available everywhere
+            for name, value in [('TCP_KEEPIDLE', tcp_keepalive),
+                                ('TCP_KEEPINTVL', max(1, tcp_keepalive // 4)),
+                                ('TCP_KEEPCNT', 4)]:
+                if hasattr(socket, name):
+                    options.append(
+                        (socket.IPPROTO_TCP, getattr(socket, name), value))
+
+        return options
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(CamomileTransport, self).request(method, url, **kwargs)
+
+
 class Camomile(object):
     """Client for Camomile REST API
 
@@ -158,6 +305,16 @@ class Camomile(object):
     delay : float, optional
         If provided, make sure at least `delay` seconds pass between
         each request to the Camomile API.  Defaults to no delay.
+    transport : requests.Session, optional
+        HTTP transport used by all requests.  Defaults to a new
+        `CamomileTransport` with default settings.
+    cache : AnnotationCache or str, optional
+        Persistent cache of `getAnnotations` and `getLayers` results (or
+        path to its SQLite file).  Defaults to no cache.
+    metadata_cache : boolean, optional
+        Cache metadata trees in memory, so that reading a path below an
+        already read path does not cost any request.  Only changes made
+        through this client are taken into account.  Defaults to False.
 
     Example
     -------
@@ -169,6 +326,23 @@ class Camomile(object):
     >>> layers = client.getLayers(corpus=corpus)
     >>> media = client.getMedia(corpus=corpus)
     >>> client.logout()
+
+    Thread safety
+    -------------
+    One logged in client can be shared by any number of threads. When
+    logged in with `keep_alive`, threads failing at the same time because of
+    an expired session or lost connection wait for one single re-login,
+    then retry their request. Make sure the transport keeps enough
+    connections open for all threads:
+
+    >>> transport = CamomileTransport(pool_maxsize=n_threads)
+    >>> client = Camomile(url, transport=transport)
+    >>> client.login(username='root', password='password', keep_alive=True)
+    >>> with ThreadPoolExecutor(n_threads) as executor:
+    ...     layers = list(executor.map(client.getLayer, layer_ids))
+
+    Logging in, logging out, and watching resources (`watchXXX` and
+    `unwatchXXX` methods) are serialized.
     """
 
     ADMIN = 3
@@ -176,17 +350,52 @@ class Camomile(object):
     READ = 1
 
     def __init__(self, url, username=None, password=None, keep_alive=False,
-                 delay=0., debug=False):
+                 delay=0., debug=False, transport=None, cache=None,
+                 metadata_cache=False):
         super(Camomile, self).__init__()
 
+        if transport is None:
+            transport = CamomileTransport()
+        self._transport = transport
+
         # internally rely on tortilla generic API wrapper
         # see http://github.com/redodo/tortilla
         self._api = tortilla.wrap(url, format='json', delay=delay, debug=debug)
+        # ... but have it send requests through our own transport
+        self._api._parent.session = transport
         self._url = url;
         self._listenerCallbacks = {}
         self._thread = None
+        self._listener_lock = threading.RLock()
+
+        # number of 'push_item' events received so far for queues
+        # waited for by `dequeue`, their watching callbacks and number
+        # of waiting threads
+        self._queue_pushes = {}
+        self._queue_callbacks = {}
+        self._queue_waiters = {}
+        self._queue_condition = threading.Condition()
 
         self._keep_alive = None
+        # incremented at each login so that concurrent threads
+        # do not all try to log in again at once
+        self._generation = 0
+        self._login_lock = threading.RLock()
+
+        # objects kept up to date with changes made through this client
+        self._observers = weakref.WeakSet()
+        self._observers_lock = threading.Lock()
+        self._indexes = weakref.WeakValueDictionary()
+
+        if cache is not None and not isinstance(cache, AnnotationCache):
+            cache = AnnotationCache(path=cache)
+        self._cache = cache
+        self._cache_callbacks = {}
+        if cache is not None:
+            self._observe(cache)
+        self._username = None
+
+        self._metadata_cache = MetadataCache() if metadata_cache else None
 
         if username:
             self.login(username, password, keep_alive=keep_alive)
@@ -255,6 +464,111 @@ class Camomile(object):
             return [r._id for r in result]
         return result._id
 
+    def _observe(self, observer):
+        """Notify `observer` of changes made through this client
+
+        `observer` is only weakly referenced and must implement an
+        `on_event(kind, id_, event)` method (see `_notify`).
+        """
+        with self._observers_lock:
+            self._observers.add(observer)
+
+    def _unobserve(self, observer):
+        """Stop notifying `observer` (see `_observe`)"""
+        with self._observers_lock:
+            self._observers.discard(observer)
+
+    def _notify(self, kind, id_, event):
+        """Notify observers of a change made through this client
+
+        Parameters
+        ----------
+        kind : {'corpus', 'layer', 'medium', 'queue', 'listener'}
+            Type of modified resource.  'listener' events (e.g.
+            {'reconnect': True}) are about the server-sent events stream.
+        id_ : str
+            ID of modified resource.  None when unknown.
+        event : dict
+            Same as server-sent events, e.g. {'add_annotation': annotation}.
+        """
+        with self._observers_lock:
+            observers = list(self._observers)
+        for observer in observers:
+            # a failing observer must not make a successful request look
+            # like it failed (and get sent again)
+            try:
+                observer.on_event(kind, id_, event)
+            except Exception as e:
+                warnings.warn('{observer!r} failed to handle {kind} event: '
+                              '{e}'.format(observer=observer, kind=kind, e=e))
+
+    def _cached(self, kind, id_, name, params, fetch):
+        """Get `fetch()` result from cache (or store it there)
+
+        Parameters
+        ----------
+        kind, id_ : str
+            Resource the result depends on (e.g. 'layer' and layer ID).
+        name : str
+            Type of result (e.g. 'annotations').
+        params : dict
+            Query parameters.
+        fetch : callable
+            Sends the actual request.
+        """
+
+        cache = self._cache
+        if cache is None:
+            return fetch()
+
+        # users may not have access to the same resources
+        key = cache.key(self._url, self._username, name, id_, params)
+
+        result = cache.get(key)
+        if result is not None:
+            return bunchify(result)
+
+        if cache.watch and id_:
+            self.__watchCached(kind, id_)
+
+        version = cache.version()
+        result = fetch()
+        cache.set(key, kind, id_, result, version=version)
+        return result
+
+    def __watchCached(self, kind, id_):
+        with self._listener_lock:
+            if (kind, id_) in self._cache_callbacks:
+                return
+
+            def callback(event):
+                self._cache.on_event(kind, id_, event)
+
+            self._cache_callbacks[kind, id_] = callback
+
+        watch = {'corpus': self.watchCorpus, 'layer': self.watchLayer}[kind]
+        try:
+            watch(id_, callback)
+        except Exception as e:
+            # cache still expires after its time to live
+            warnings.warn('Could not watch {kind} {id_}: {e}'.format(
+                kind=kind, id_=id_, e=e))
+
+    def _stream(self, route, params=None):
+        """Send GET request to `route` without loading the response body"""
+        response = self._transport.get(route.url(), params=params,
+                                       stream=True)
+        response.raise_for_status()
+        return response
+
+    def _upload(self, route, chunks):
+        """Send POST request to `route` with a (chunked) streamed body"""
+        headers = {'Content-Type': 'application/json'}
+        response = self._transport.post(route.url(), data=chunks,
+                                        headers=headers)
+        response.raise_for_status()
+        return bunchify(response.json())
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # AUTHENTICATION
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -276,53 +590,77 @@ class Camomile(object):
         credentials = {'username': username,
                        'password': password}
 
-        result = self._api.login.post(data=credentials)
+        with self._login_lock:
+
+            result = self._api.login.post(data=credentials)
+
+            if keep_alive:
+                self._keep_alive = credentials
 
-        if keep_alive:
-            self._keep_alive = credentials
+            self._username = username
+            self._generation += 1
 
         return result
 
-    def _resuscitate(self, max_trials=-1):
+    def _resuscitate(self, max_trials=-1, generation=None):
         """Try rescuscitating a dead "keep_alive" client
 
         Parameters
         ----------
         max_trials : int, optional
             Default to unlimited number of trials.
+        generation : int, optional
+            Login generation the failing request was sent with. Nothing is
+            done if another thread already logged in again since then.
         """
 
-        username = self._keep_alive['username']
-        password = self._keep_alive['password']
+        with self._login_lock:
 
-        trials = 0
+            if generation is not None and generation != self._generation:
+                return
 
-        success = None
-        while trials != max_trials:
-            try:
-                success = self.login(username, password=password,
-                                     keep_alive=True)
-                if success:
-                    break
-            except requests.exceptions.ConnectionError as e:
-                trials += 1
-                wait = 2 ** trials
-                warning = 'Lost connection. Waiting {wait:d} seconds before trying again...'
-                warnings.warn(warning.format(wait=wait))
-                time.sleep(wait)
+            # logged out in the meantime
+            if not self._keep_alive:
+                return
+
+            username = self._keep_alive['username']
+            password = self._keep_alive['password']
+
+            trials = 0
+
+            success = None
+            while trials != max_trials:
+                try:
+                    success = self.login(username, password=password,
+                                         keep_alive=True)
+                    if success:
+                        break
+                except requests.exceptions.ConnectionError as e:
+                    trials += 1
+                    wait = 2 ** trials
+                    warning = 'Lost connection. Waiting {wait:d} seconds before trying again...'
+                    warnings.warn(warning.format(wait=wait))
+                    time.sleep(wait)
 
 
     @CamomileErrorHandling(resuscitate=False)
     def logout(self):
         """Logout"""
 
-        if self._thread:
-           self._thread.isRun = False
-           self._thread = None
+        with self._listener_lock:
+            if self._thread:
+               self._thread.isRun = False
+               self._thread = None
+            # subscriptions belong to the channel of the closed session
+            self._listenerCallbacks.clear()
+            # cached resources and threads waiting in `dequeue` will
+            # watch again on the next channel
+            self._cache_callbacks.clear()
+            self._queue_callbacks.clear()
 
-        self._keep_alive = None
-
-        return self._api.logout.post()
+        with self._login_lock:
+            self._keep_alive = None
+            return self._api.logout.post()
 
     @CamomileErrorHandling()
     def me(self, returns_id=False):
@@ -786,6 +1124,7 @@ class Camomile(object):
                   'description': description if description else {}}
 
         result = self._corpus(corpus).medium.post(data=medium)
+        self._notify('corpus', corpus, {'add_medium': result})
         return self._id(result) if returns_id else result
 
     @CamomileErrorHandling()
@@ -807,6 +1146,8 @@ class Camomile(object):
             List of new media.
         """
         result = self._corpus(corpus).medium.post(data=media)
+        for medium in result:
+            self._notify('corpus', corpus, {'add_medium': medium})
         return self._id(result) if returns_id else result
 
     @CamomileErrorHandling()
@@ -838,7 +1179,9 @@ class Camomile(object):
         if description is not None:
             data['description'] = description
 
-        return self._medium(medium).put(data=data)
+        result = self._medium(medium).put(data=data)
+        self._notify('medium', medium, {'update': sorted(data)})
+        return result
 
     @CamomileErrorHandling()
     def deleteMedium(self, medium):
@@ -849,7 +1192,12 @@ class Camomile(object):
         medium : str
             Medium ID
         """
-        return self._medium(medium).delete()
+        result = self._medium(medium).delete()
+
+        # corpus is unknown at this point
+        self._notify('corpus', None, {'delete_medium': medium})
+
+        return result
 
     @CamomileErrorHandling()
     def streamMedium(self, medium, format=None):
@@ -868,6 +1216,52 @@ class Camomile(object):
 
         return self._medium(medium).get(format)
 
+    @CamomileErrorHandling()
+    def downloadMedium(self, medium, path, format=None, chunk_size=1 << 20,
+                       parallel=1, max_retries=3):
+        """Download medium to file
+
+        Unlike `streamMedium`, the medium is written to disk while being
+        downloaded (memory usage does not depend on its size), and
+        interrupted downloads are resumed (with HTTP Range requests) rather
+        than started over.
+
+        Parameters
+        ----------
+        medium : str
+            Medium ID
+        path : str
+            Path to output file.  Partial downloads are stored in
+            `path` + '.part' until complete.
+        format : {'webm', 'mp4', 'ogv', 'mp3', 'wav'}, optional
+            Streaming format.
+        chunk_size : int, optional
+            Size of chunks written to disk, in bytes.  Defaults to 1MB.
+        parallel : int, optional
+            Number of concurrent ranged requests for large files (split into
+            16MB pieces).  Defaults to 1.
+        max_retries : int, optional
+            Number of times an interrupted download is resumed right away.
+            Defaults to 3.
+
+        Returns
+        -------
+        path : str
+
+        Example
+        -------
+        >>> client.downloadMedium(medium, '/tmp/medium.mp4', format='mp4',
+        ...                       parallel=4)
+        """
+
+        if format is None:
+            format = 'video'
+
+        url = self._medium(medium)(format).url()
+        download(self._transport, url, path, chunk_size=chunk_size,
+                 parallel=parallel, max_retries=max_retries)
+        return path
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # LAYERS
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -930,9 +1324,12 @@ class Camomile(object):
             params['data_type'] = data_type
 
         if corpus:
-            result = self._corpus(corpus).layer.get(params=params)
+            route = self._corpus(corpus).layer
         else:
-            result = self._layer().get(params=params)
+            route = self._layer()
+
+        result = self._cached('corpus', corpus, 'layers', params,
+                              lambda: route.get(params=params))
 
         return self._id(result) if returns_id else result
 
@@ -940,7 +1337,8 @@ class Camomile(object):
     def createLayer(self, corpus,
                     name, description=None,
                     fragment_type=None, data_type=None,
-                    annotations=None, returns_id=False):
+                    annotations=None, returns_id=False,
+                    chunk_size=None, max_workers=4, max_retries=3):
         """Add new layer to corpus
 
         Parameters
@@ -955,10 +1353,14 @@ class Camomile(object):
             Layer fragment type.  Must be JSON-serializable.
         data_type : object, optional
             Layer data type.  Must be JSON-serializable.
-        annotations : list, optional
+        annotations : iterable, optional
             List of annotations.
         returns_id : boolean, optional.
             Returns IDs rather than dictionaries.
+        chunk_size, max_workers, max_retries : int, optional
+            When `chunk_size` is provided, the layer is first created empty
+            and `annotations` are then uploaded in chunks.
+            See `createAnnotations`.
 
         Returns
         -------
@@ -969,9 +1371,19 @@ class Camomile(object):
                  'fragment_type': fragment_type if fragment_type else {},
                  'data_type': data_type if data_type else {},
                  'description': description if description else {},
-                 'annotations': annotations if annotations else []}
+                 'annotations': []}
+
+        if annotations and chunk_size is None:
+            layer['annotations'] = list(annotations)
 
         result = self._corpus(corpus).layer.post(data=layer)
+        self._notify('corpus', corpus, {'add_layer': result})
+
+        if annotations and chunk_size is not None:
+            self.createAnnotations(self._id(result), annotations,
+                                   chunk_size=chunk_size,
+                                   max_workers=max_workers,
+                                   max_retries=max_retries)
 
         return self._id(result) if returns_id else result
 
@@ -1010,7 +1422,9 @@ class Camomile(object):
         if data_type is not None:
             data['data_type'] = data_type
 
-        return self._layer(layer).put(data=data)
+        result = self._layer(layer).put(data=data)
+        self._notify('layer', layer, {'update': sorted(data)})
+        return result
 
     @CamomileErrorHandling()
     def deleteLayer(self, layer):
@@ -1021,7 +1435,12 @@ class Camomile(object):
         layer : str
             Layer ID
         """
-        return self._layer(layer).delete()
+        result = self._layer(layer).delete()
+
+        # corpus is unknown at this point
+        self._notify('corpus', None, {'delete_layer': layer})
+
+        return result
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ANNOTATIONS
@@ -1050,7 +1469,7 @@ class Camomile(object):
     def getAnnotations(self, layer=None, medium=None,
                        fragment=None, data=None,
                        history=False, returns_id=False,
-                       returns_count=False):
+                       returns_count=False, returns_array=False):
         """Get annotations
 
         Parameters
@@ -1069,14 +1488,27 @@ class Camomile(object):
             Returns IDs rather than dictionaries.
         returns_count : boolean, optional.
             Returns number of annotations instead of annotations
+        returns_array : boolean, optional.
+            Returns annotations as an `AnnotationArray` (segment layers only,
+            requires numpy). The response is then parsed incrementally so
+            that no intermediate list of annotations is ever built.
+            Needs a `layer` and cannot be combined with `returns_id` or
+            `returns_count`.
 
         Returns
         -------
-        annotations : list
+        annotations : list or AnnotationArray
             List of annotations.
 
         """
 
+        if returns_array:
+            if not layer:
+                raise ValueError('returns_array needs a layer')
+            if returns_id or returns_count:
+                raise ValueError('returns_array cannot be combined with '
+                                 'returns_id or returns_count')
+
         params = {'history': 'on'} if history else {}
         if medium:
             params['id_medium'] = medium
@@ -1090,8 +1522,16 @@ class Camomile(object):
             route = self._layer(layer).annotation
             if returns_count:
                 # /layer/:id_layer/annotation/count
-                route = route.count
-            result = route.get(params=params)
+                result = route.count.get(params=params)
+            elif returns_array and self._cache is None:
+                response = self._stream(route, params=params)
+                return AnnotationArray.from_annotations(
+                    self.__iterAnnotations(response, 65536, False))
+            else:
+                result = self._cached('layer', layer, 'annotations', params,
+                                      lambda: route.get(params=params))
+                if returns_array:
+                    return AnnotationArray.from_annotations(result)
 
         else:
             # admin user only
@@ -1104,6 +1544,243 @@ class Camomile(object):
                 if (returns_id and not returns_count)
                 else result)
 
+    @CamomileErrorHandling()
+    def iterAnnotations(self, layer, medium=None, fragment=None, data=None,
+                        history=False, returns_id=False, chunk_size=65536):
+        """Iterate over annotations of a layer
+
+        Unlike `getAnnotations`, the response is parsed incrementally while
+        being downloaded, so that memory usage does not depend on the number
+        of annotations.
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        medium : str, optional
+            Filter annotations by medium.
+        fragment : optional
+            Filter annotations by fragment.
+        data : optional
+            Filter annotations by data.
+        history : boolean, optional
+            Whether to return history.  Defaults to False.
+        returns_id : boolean, optional.
+            Yields IDs rather than dictionaries.
+        chunk_size : int, optional
+            Size of downloaded chunks, in bytes.  Defaults to 64kB.
+
+        Returns
+        -------
+        annotations : iterator
+            Iterator over annotations.
+
+        Example
+        -------
+        >>> for annotation in client.iterAnnotations(layer):
+        ...     process(annotation)
+        """
+
+        params = {'history': 'on'} if history else {}
+        if medium:
+            params['id_medium'] = medium
+        if fragment:
+            params['fragment'] = fragment
+        if data:
+            params['data'] = data
+
+        # /layer/:id_layer/annotation
+        # (request is sent right away so that errors are raised right away)
+        response = self._stream(self._layer(layer).annotation, params=params)
+
+        return self.__iterAnnotations(response, chunk_size, returns_id)
+
+    def __iterAnnotations(self, response, chunk_size, returns_id):
+        try:
+            items = iter_json_array(iter_text(response, chunk_size))
+            for annotation in items:
+                if returns_id:
+                    yield annotation['_id']
+                else:
+                    yield bunchify(annotation)
+        finally:
+            response.close()
+
+    def iterAnnotationsByMedium(self, layer, media=None,
+                                fragment=None, data=None, history=False,
+                                returns_id=False, returns_array=False,
+                                max_workers=8, max_retries=3):
+        """Concurrently get annotations of a layer, one medium at a time
+
+        The layer is read with one request per medium, with at most
+        `max_workers` requests at a time.  Annotations that are not attached
+        to any medium are ignored.
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        media : iterable, optional
+            Medium IDs.  Defaults to all media of the layer's corpus.
+        fragment, data, history, returns_id, returns_array : optional
+            See `getAnnotations`.
+        max_workers : int, optional
+            Maximum number of concurrent requests.  Defaults to 8.
+        max_retries : int, optional
+            Number of times a request is sent again after a connection error,
+            timeout or internal server error.  Defaults to 3.
+
+        Returns
+        -------
+        annotations : iterator
+            Iterator over (medium, annotations) pairs, in completion order.
+
+        Example
+        -------
+        >>> for medium, annotations in client.iterAnnotationsByMedium(layer):
+        ...     process(medium, annotations)
+        """
+
+        if media is None:
+            corpus = self.getLayer(layer).id_corpus
+            media = self.getMedia(corpus=corpus, returns_id=True)
+
+        def get(medium):
+            return self.getAnnotations(layer=layer, medium=medium,
+                                       fragment=fragment, data=data,
+                                       history=history, returns_id=returns_id,
+                                       returns_array=returns_array)
+
+        return parallel_imap_unordered(get, media,
+                                       max_workers=max_workers,
+                                       max_retries=max_retries,
+                                       retry_on=RETRIABLE_ERRORS)
+
+    def getAnnotationsByMedium(self, layer, media=None,
+                               fragment=None, data=None, history=False,
+                               returns_id=False, returns_array=False,
+                               merge=False, max_workers=8, max_retries=3):
+        """Concurrently get annotations of a layer, one medium at a time
+
+        Parameters
+        ----------
+        layer, media, fragment, data, history, returns_id, returns_array :
+            See `iterAnnotationsByMedium`.
+        merge : boolean, optional
+            Return one list (or `AnnotationArray`) of annotations rather than
+            a dictionary.  Defaults to False.
+        max_workers, max_retries : int, optional
+            See `iterAnnotationsByMedium`.
+
+        Returns
+        -------
+        annotations : dict, list or AnnotationArray
+            Dictionary indexed by medium ID whose values are list of
+            annotations.  When `merge` is True, annotations ordered by medium
+            (in `media` order).
+        """
+
+        if media is None:
+            corpus = self.getLayer(layer).id_corpus
+            media = self.getMedia(corpus=corpus, returns_id=True)
+        else:
+            media = list(media)
+
+        annotations = dict(self.iterAnnotationsByMedium(
+            layer, media=media, fragment=fragment, data=data,
+            history=history, returns_id=returns_id,
+            returns_array=returns_array,
+            max_workers=max_workers, max_retries=max_retries))
+
+        if not merge:
+            return annotations
+
+        if returns_array:
+            return AnnotationArray.concatenate(
+                annotations[medium] for medium in media)
+
+        return [annotation for medium in media
+                for annotation in annotations[medium]]
+
+    def getIntervalIndex(self, layer, medium):
+        """Get time index over annotations of one medium of a segment layer
+
+        The index is built once from `getAnnotations` and then kept up to
+        date with annotations created, updated or deleted through this
+        client.  Calling `getIntervalIndex` again while the index is still
+        in use returns the same index.
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        medium : str
+            Medium ID.
+
+        Returns
+        -------
+        index : IntervalIndex
+
+        Example
+        -------
+        >>> index = client.getIntervalIndex(layer, medium)
+        >>> for annotation in index.overlapping(t0, t1):
+        ...     print(annotation.data)
+        """
+
+        index = self._indexes.get((layer, medium), None)
+        if index is not None:
+            return index
+
+        annotations = self.iterAnnotations(layer, medium=medium)
+        index = IntervalIndex(annotations, layer=layer, medium=medium)
+
+        self._observe(index)
+        self._indexes[layer, medium] = index
+
+        return index
+
+    def exportLayer(self, layer, path, format=None, medium=None):
+        """Export segment layer to columnar file
+
+        Annotations are parsed into columns while being downloaded, labels
+        and media are dictionary-encoded and medium names are resolved.
+        Parquet and Arrow files are written one batch of annotations at a
+        time, so that the whole layer is never held in memory.
+        Use `AnnotationArray.load` to (memory-map and) load the file.
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        path : str
+            Path to output file.
+        format : {'parquet', 'arrow', 'npz'}, optional
+            Defaults to guessing from `path` extension.  'parquet' and
+            'arrow' require `pyarrow`.
+        medium : str, optional
+            Only export annotations of this medium.
+
+        Returns
+        -------
+        n : int
+            Number of exported annotations.
+
+        Example
+        -------
+        >>> client.exportLayer(layer, 'layer.arrow')
+        >>> annotations = AnnotationArray.load('layer.arrow')
+        """
+
+        # fail before downloading anything
+        format = guess_format(path, format=format)
+
+        corpus = self.getLayer(layer).id_corpus
+        names = dict((m._id, m.name) for m in self.getMedia(corpus=corpus))
+
+        annotations = self.iterAnnotations(layer, medium=medium)
+        return export(annotations, path, format=format, media_names=names)
+
     @CamomileErrorHandling()
     def createAnnotation(self, layer, medium=None, fragment=None, data=None,
                          returns_id=False):
@@ -1124,16 +1801,74 @@ class Camomile(object):
 
         result = self._layer(layer).annotation.post(data=annotation)
 
+        self._notify('layer', layer, {'add_annotation': result})
+
         return self._id(result) if returns_id else result
 
-    @CamomileErrorHandling()
-    def createAnnotations(self, layer, annotations, returns_id=False):
-        """
-                returns_id : boolean, optional.
+    def createAnnotations(self, layer, annotations, returns_id=False,
+                          chunk_size=None, max_workers=4, max_retries=3):
+        """Create several annotations
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        annotations : iterable or AnnotationArray
+            Annotations, as dictionaries with 'id_medium', 'fragment' and
+            'data' keys.  Any iterable (e.g. a generator) is accepted.
+        returns_id : boolean, optional.
             Returns IDs rather than dictionaries.
+        chunk_size : int, optional
+            When provided, split `annotations` into chunks of `chunk_size`
+            annotations, sent concurrently as separate requests.  Defaults to
+            sending all annotations at once.
+        max_workers : int, optional
+            Maximum number of chunks being sent at the same time.
+            Defaults to 4.
+        max_retries : int, optional
+            Number of times a chunk is sent again when it could not reach
+            the server (see `is_unsent`).  Defaults to 3.  Chunks are not
+            sent again after any other error, as the server may already
+            have created their annotations.
+
+        Returns
+        -------
+        annotations : list
+            Newly created annotations (or their IDs), in input order.
+
+        Example
+        -------
+        >>> annotations = ({'id_medium': medium,
+        ...                 'fragment': {'start': start, 'end': end},
+        ...                 'data': label} for start, end, label in segments)
+        >>> client.createAnnotations(layer, annotations, chunk_size=5000,
+        ...                          max_workers=8, returns_id=True)
         """
+
+        if isinstance(annotations, AnnotationArray):
+            annotations = annotations.to_annotations(with_id=False)
+
+        if chunk_size is None:
+            result = self._postAnnotations(layer, list(annotations))
+            return self._id(result) if returns_id else result
+
+        post = lambda chunk: self._postAnnotations(layer, chunk)
+
+        result = []
+        for created in parallel_imap(post, chunks(annotations, chunk_size),
+                                     max_workers=max_workers,
+                                     max_retries=max_retries,
+                                     retry_on=is_unsent):
+            result.extend(self._id(created) if returns_id else created)
+
+        return result
+
+    @CamomileErrorHandling(resend=False)
+    def _postAnnotations(self, layer, annotations):
         result = self._layer(layer).annotation.post(data=annotations)
-        return self._id(result) if returns_id else result
+        for annotation in result:
+            self._notify('layer', layer, {'add_annotation': annotation})
+        return result
 
     @CamomileErrorHandling()
     def updateAnnotation(self, annotation, fragment=None, data=None):
@@ -1158,7 +1893,12 @@ class Camomile(object):
         if data is not None:
             _data['data'] = data
 
-        return self._annotation(annotation).put(data=_data)
+        result = self._annotation(annotation).put(data=_data)
+
+        self._notify('layer', result.get('id_layer', None),
+                     {'update_annotation': result})
+
+        return result
 
     @CamomileErrorHandling()
     def deleteAnnotation(self, annotation):
@@ -1169,7 +1909,214 @@ class Camomile(object):
         annotation : str
             Annotation ID
         """
-        return self._annotation(annotation).delete()
+        result = self._annotation(annotation).delete()
+
+        # layer is unknown at this point
+        self._notify('layer', None, {'delete_annotation': annotation})
+
+        return result
+
+    def updateAnnotations(self, updates, max_workers=8, max_retries=3,
+                          return_exceptions=True):
+        """Update several existing annotations concurrently
+
+        Parameters
+        ----------
+        updates : iterable
+            (annotation, fragment, data) tuples, where `annotation` is the
+            annotation ID and `fragment` and `data` are the new fragment
+            and data (or None to leave them untouched).
+        max_workers : int, optional
+            Maximum number of concurrent requests.  Defaults to 8.
+        max_retries : int, optional
+            Number of times a request is sent again after a connection error,
+            timeout or internal server error.  Defaults to 3.
+        return_exceptions : boolean, optional
+            When True (default), failed updates do not interrupt the others
+            and their exception is returned in place of the updated
+            annotation.  When False, the first failure is raised.
+
+        Returns
+        -------
+        annotations : list
+            Updated annotations (or exceptions), in input order.
+
+        Example
+        -------
+        >>> results = client.updateAnnotations(
+        ...     (annotation, None, 'new_label') for annotation in annotations)
+        >>> failed = [r for r in results if isinstance(r, Exception)]
+        """
+
+        update = lambda u: self.updateAnnotation(u[0], fragment=u[1],
+                                                 data=u[2])
+
+        return parallel_map(update, updates,
+                            max_workers=max_workers,
+                            max_retries=max_retries,
+                            retry_on=RETRIABLE_ERRORS,
+                            return_exceptions=return_exceptions)
+
+    def deleteAnnotations(self, annotations, max_workers=8, max_retries=3,
+                          return_exceptions=True):
+        """Delete several existing annotations concurrently
+
+        Parameters
+        ----------
+        annotations : iterable
+            Annotation IDs.
+        max_workers, max_retries, return_exceptions : optional
+            See `updateAnnotations`.
+
+        Returns
+        -------
+        results : list
+            Server responses (or exceptions), in input order.
+        """
+
+        return parallel_map(self.deleteAnnotation, annotations,
+                            max_workers=max_workers,
+                            max_retries=max_retries,
+                            retry_on=RETRIABLE_ERRORS,
+                            return_exceptions=return_exceptions)
+
+    @staticmethod
+    def _canonical(value):
+        """JSON representation of `value`, as comparable as possible
+
+        Floats with integral values are serialized like integers, since
+        the server may send back 1.0 as 1.
+        """
+
+        def normalize(value):
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, dict):
+                return {k: normalize(v) for k, v in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            return value
+
+        return json.dumps(normalize(value), sort_keys=True)
+
+    @classmethod
+    def _annotationKey(cls, annotation):
+        return (annotation.get('id_medium', None),
+                cls._canonical(annotation.get('fragment', None)))
+
+    def syncLayer(self, layer, annotations, key=None, chunk_size=1000,
+                  max_workers=4, max_retries=3, dry_run=False):
+        """Make layer contain exactly `annotations`, with minimal changes
+
+        The layer is downloaded once, matched against `annotations`, and
+        only the differences are sent back (in bulk, concurrently):
+
+        - local annotations with no remote counterpart are created,
+        - remote annotations with no local counterpart are deleted,
+        - matching annotations whose fragment or data differ are updated.
+
+        Parameters
+        ----------
+        layer : str
+            Layer ID.
+        annotations : iterable or AnnotationArray
+            Desired annotations, as dictionaries with 'id_medium', 'fragment'
+            and 'data' keys.
+        key : callable, optional
+            Function of an annotation returning a hashable value identifying
+            it: a local and a remote annotation with the same key are
+            considered the same annotation.  Defaults to matching annotations
+            with the same medium and fragment (hence only differing by data).
+        chunk_size : int, optional
+            Number of annotations per creation request.  Defaults to 1000.
+        max_workers, max_retries : int, optional
+            See `createAnnotations`, `updateAnnotations` and
+            `deleteAnnotations`.
+        dry_run : boolean, optional
+            Only compute the changes, do not apply them.
+
+        Returns
+        -------
+        changes : dict
+            {'created': [...], 'updated': [...], 'deleted': [...],
+             'unchanged': n} where 'created' and 'updated' contain the created
+            and updated annotations, 'deleted' the IDs of deleted annotations
+            and 'unchanged' is the number of annotations left untouched.
+            With `dry_run`, 'created' and 'updated' contain the annotations
+            that would be sent instead.
+
+        Example
+        -------
+        >>> changes = client.syncLayer(hypothesis, annotations)
+        >>> print(len(changes['created']), len(changes['deleted']))
+        """
+
+        if key is None:
+            key = self._annotationKey
+
+        if isinstance(annotations, AnnotationArray):
+            annotations = annotations.to_annotations(with_id=False)
+
+        content = lambda a: self._canonical([a.get('fragment', None),
+                                             a.get('data', None)])
+
+        # remote annotations, indexed by key
+        remote = {}
+        for annotation in self.iterAnnotations(layer):
+            remote.setdefault(key(annotation), []).append(annotation)
+
+        to_create, to_update, unchanged = [], [], 0
+
+        for annotation in annotations:
+            matches = remote.get(key(annotation), None)
+            if not matches:
+                to_create.append(annotation)
+                continue
+
+            match = matches.pop(0)
+            if content(match) == content(annotation):
+                unchanged += 1
+                continue
+
+            to_update.append((match._id,
+                              annotation.get('fragment', None),
+                              annotation.get('data', None)))
+
+        # remote annotations left unmatched
+        to_delete = [a._id for matches in remote.values() for a in matches]
+
+        if dry_run:
+            return {'created': to_create,
+                    'updated': to_update,
+                    'deleted': to_delete,
+                    'unchanged': unchanged}
+
+        def delete(annotation):
+            try:
+                return self.deleteAnnotation(annotation)
+            except CamomileNotFound:
+                # already deleted, e.g. by a first attempt that timed out
+                # after the server processed it
+                return None
+
+        parallel_map(delete, to_delete,
+                     max_workers=max_workers,
+                     max_retries=max_retries,
+                     retry_on=RETRIABLE_ERRORS,
+                     return_exceptions=False)
+
+        updated = self.updateAnnotations(to_update, max_workers=max_workers,
+                                         max_retries=max_retries,
+                                         return_exceptions=False)
+
+        created = self.createAnnotations(
+            layer, to_create, chunk_size=chunk_size,
+            max_workers=max_workers, max_retries=max_retries)
+
+        return {'created': created,
+                'updated': updated,
+                'deleted': to_delete,
+                'unchanged': unchanged}
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # QUEUES
@@ -1259,7 +2206,7 @@ class Camomile(object):
 
         return self._queue(queue).put(data=data)
 
-    @CamomileErrorHandling()
+    @CamomileErrorHandling(resend=False)
     def enqueue(self, queue, elements):
         """Enqueue elements
 
@@ -1282,20 +2229,115 @@ class Camomile(object):
         return self._queue(queue).next.put(data=elements)
 
     @CamomileErrorHandling()
-    def dequeue(self, queue):
+    def __dequeue(self, queue):
+        return self._queue(queue).next.get()
+
+    def dequeue(self, queue, wait=False, timeout=None, poll_interval=30.):
         """Dequeue element
 
         Parameters
         ----------
         queue : str
             Queue ID
+        wait : boolean, optional
+            When True and the queue is empty, block until an element is
+            pushed (as reported by server-sent events) rather than failing.
+            Defaults to False.
+        timeout : float, optional
+            Maximum waiting time in seconds (when `wait` is True).
+            Defaults to waiting forever.
+        poll_interval : float, optional
+            Try dequeuing at least every `poll_interval` seconds while
+            waiting, in case a server-sent event was missed.
+            Defaults to 30 seconds.
 
         Returns
         -------
         element : object
             Popped element from queue.
+
+        Raises
+        ------
+        CamomileNotFound
+            When the queue is (still) empty.
         """
-        return self._queue(queue).next.get()
+
+        if not wait:
+            return self.__dequeue(queue)
+
+        self.__enterQueue(queue)
+        try:
+            return self.__waitDequeue(queue, timeout, poll_interval)
+        finally:
+            self.__leaveQueue(queue)
+
+    def __waitDequeue(self, queue, timeout, poll_interval):
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+
+            with self._queue_condition:
+                pushes = self._queue_pushes.get(queue, 0)
+
+            try:
+                element = self.__dequeue(queue)
+            except CamomileNotFound:
+                element = None
+            if element is not None:
+                return element
+
+            # queue is only watched once found empty, and tried again
+            # right away as a push may have happened in the meantime
+            if self.__watchPushes(queue):
+                continue
+
+            delay = poll_interval
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise CamomileNotFound('Empty queue.')
+                delay = min(delay, remaining)
+
+            with self._queue_condition:
+                if self._queue_pushes.get(queue, 0) == pushes:
+                    self._queue_condition.wait(delay)
+
+    def iterQueue(self, queue, timeout=None, poll_interval=30.):
+        """Iterate over elements of queue, as soon as they are pushed
+
+        Elements are dequeued (hence removed from the queue) one at a time,
+        right before being yielded.  The iterator sleeps while the queue is
+        empty and wakes up on server-sent events.
+
+        Parameters
+        ----------
+        queue : str
+            Queue ID
+        timeout : float, optional
+            Stop iterating once the queue has remained empty for `timeout`
+            seconds.  Defaults to iterating forever.
+        poll_interval : float, optional
+            See `dequeue`.
+
+        Returns
+        -------
+        elements : iterator
+        """
+
+        # keep watching the queue between two elements
+        self.__enterQueue(queue)
+        try:
+            while True:
+                try:
+                    element = self.__waitDequeue(queue, timeout,
+                                                 poll_interval)
+                except CamomileNotFound:
+                    return
+                yield element
+        finally:
+            self.__leaveQueue(queue)
 
     @CamomileErrorHandling()
     def pick(self, queue):
@@ -1643,10 +2685,35 @@ class Camomile(object):
         path : str
             metadata path
         filepath : str
-            metadata filepath
+            metadata filepath.  The file is read and encoded while being
+            sent, so that its size does not matter.
         """
         return self.__sendMetadataFile(self._corpus(corpus), path, filepath)
 
+    @CamomileErrorHandling()
+    def downloadCorpusMetadataFile(self, corpus, path, dest):
+        """Download corpus metadata file
+
+        Unlike `getCorpusMetadata` with `file=True`, the file is decoded
+        while being downloaded and written directly to disk (memory usage
+        does not depend on its size), and binary files are supported.
+
+        Parameters
+        ----------
+        corpus : str
+            corpus ID
+        path : str
+            metadata path
+        dest : str
+            path to output file
+
+        Returns
+        -------
+        metadata : dict
+            File metadata (e.g. 'filename'), except for its content.
+        """
+        return self.__downloadMetadataFile(self._corpus(corpus), path, dest)
+
     @CamomileErrorHandling()
     def deleteCorpusMetadata(self, corpus, path):
         """Delete Corpus metadatas
@@ -1725,10 +2792,35 @@ class Camomile(object):
         path : str
             metadata path
         filepath : str
-            metadata filepath
+            metadata filepath.  The file is read and encoded while being
+            sent, so that its size does not matter.
         """
         return self.__sendMetadataFile(self._layer(layer), path, filepath)
 
+    @CamomileErrorHandling()
+    def downloadLayerMetadataFile(self, layer, path, dest):
+        """Download layer metadata file
+
+        Unlike `getLayerMetadata` with `file=True`, the file is decoded
+        while being downloaded and written directly to disk (memory usage
+        does not depend on its size), and binary files are supported.
+
+        Parameters
+        ----------
+        layer : str
+            layer ID
+        path : str
+            metadata path
+        dest : str
+            path to output file
+
+        Returns
+        -------
+        metadata : dict
+            File metadata (e.g. 'filename'), except for its content.
+        """
+        return self.__downloadMetadataFile(self._layer(layer), path, dest)
+
     @CamomileErrorHandling()
     def deleteLayerMetadata(self, layer, path):
         """Delete Layer metadatas
@@ -1809,10 +2901,35 @@ class Camomile(object):
         path : str
             metadata path
         filepath : str
-            metadata filepath
+            metadata filepath.  The file is read and encoded while being
+            sent, so that its size does not matter.
         """
         return self.__sendMetadataFile(self._medium(medium), path, filepath)
 
+    @CamomileErrorHandling()
+    def downloadMediumMetadataFile(self, medium, path, dest):
+        """Download medium metadata file
+
+        Unlike `getMediumMetadata` with `file=True`, the file is decoded
+        while being downloaded and written directly to disk (memory usage
+        does not depend on its size), and binary files are supported.
+
+        Parameters
+        ----------
+        medium : str
+            medium ID
+        path : str
+            metadata path
+        dest : str
+            path to output file
+
+        Returns
+        -------
+        metadata : dict
+            File metadata (e.g. 'filename'), except for its content.
+        """
+        return self.__downloadMetadataFile(self._medium(medium), path, dest)
+
     @CamomileErrorHandling()
     def deleteMediumMetadata(self, medium, path):
         """Delete Medium metadatas
@@ -1826,12 +2943,121 @@ class Camomile(object):
         """
         return self.__deleteMetadata(self._medium(medium), path)
 
+    def __metadataResource(self, resource):
+        kind, id_ = resource
+        routes = {'corpus': self._corpus, 'layer': self._layer,
+                  'medium': self._medium}
+        if kind not in routes:
+            raise ValueError(
+                'Resource kind must be one of "corpus", "layer" or "medium".')
+        return routes[kind](id_)
+
+    @CamomileErrorHandling()
+    def __walkMetadata(self, resource, path=None):
+        resource = self.__metadataResource(resource)
+        # one request per (top-level) key, as whole subtrees are returned
+        return dict((key, self.__getMetadata(
+                        resource, path=key if path is None
+                        else path + '.' + key))
+                    for key in self.__getMetadataKeys(resource, path=path))
+
+    @CamomileErrorHandling()
+    def __setResourceMetadata(self, resource, metadata, path=None):
+        resource = self.__metadataResource(resource)
+        return self.__setMetadata(resource, metadata, path=path)
+
+    def walkMetadata(self, resources, path=None, max_workers=8,
+                     max_retries=3, return_exceptions=True):
+        """Concurrently get whole metadata trees of many resources
+
+        Parameters
+        ----------
+        resources : iterable
+            (kind, ID) tuples, where `kind` is one of 'corpus', 'layer' or
+            'medium'.
+        path : str, optional
+            Only get metadata below this path.
+        max_workers : int, optional
+            Maximum number of resources processed at the same time.
+            Defaults to 8.
+        max_retries : int, optional
+            Number of times a resource is processed again after a connection
+            error, timeout or internal server error.  Defaults to 3.
+        return_exceptions : boolean, optional
+            When True (default), failures do not interrupt the others and
+            their exception is yielded in place of the metadata tree.  When
+            False, the first failure is raised.
+
+        Returns
+        -------
+        metadata : iterator
+            Iterator over (resource, metadata) pairs, in completion order.
+
+        Example
+        -------
+        >>> media = client.getMedia(corpus=corpus, returns_id=True)
+        >>> mirror = dict(client.walkMetadata(
+        ...     ('medium', medium) for medium in media))
+        """
+
+        walk = lambda resource: self.__walkMetadata(resource, path=path)
+
+        return parallel_imap_unordered(walk, resources,
+                                       max_workers=max_workers,
+                                       max_retries=max_retries,
+                                       retry_on=RETRIABLE_ERRORS,
+                                       return_exceptions=return_exceptions)
+
+    def setMetadataMany(self, metadata, path=None, max_workers=8,
+                        max_retries=3, return_exceptions=True):
+        """Concurrently set metadata of many resources
+
+        Parameters
+        ----------
+        metadata : dict
+            {(kind, ID): metadata} dictionary, where `kind` is one of
+            'corpus', 'layer' or 'medium'.
+        path : str, optional
+            Set metadata at this path.
+        max_workers, max_retries, return_exceptions : optional
+            See `walkMetadata`.
+
+        Returns
+        -------
+        results : dict
+            {(kind, ID): result (or exception)} dictionary.
+
+        Example
+        -------
+        >>> client.setMetadataMany(
+        ...     dict((('medium', m), {'duration': d})
+        ...          for m, d in durations.items()))
+        """
+
+        set_ = lambda resource: self.__setResourceMetadata(
+            resource, metadata[resource], path=path)
+
+        return dict(parallel_imap_unordered(
+            set_, metadata,
+            max_workers=max_workers, max_retries=max_retries,
+            retry_on=RETRIABLE_ERRORS, return_exceptions=return_exceptions))
+
     def __getMetadata(self, resource, path=None, file=False):
 
         if path is None:
-            metadata = resource.metadata().get()
-        else:
+            # list of keys, actually
+            return self.__getMetadataKeys(resource)
+
+        cache = self._metadata_cache
+        if cache is None:
             metadata = resource.metadata(path).get()
+        else:
+            try:
+                metadata = bunchify(cache.get(resource.url(), path))
+            except KeyError:
+                version = cache.version(resource.url())
+                metadata = resource.metadata(path).get()
+                cache.set(resource.url(), path, metadata, version=version)
 
         if file:
             metadata = b64decode(metadata['data']).decode()
@@ -1840,70 +3066,236 @@ class Camomile(object):
 
     def __getMetadataKeys(self, resource, path=None):
 
+        cache = self._metadata_cache
+        if cache is not None:
+            try:
+                return cache.keys(resource.url(), path)
+            except KeyError:
+                version = cache.version(resource.url())
+
         if path is None:
-            return resource.metadata().get()
+            keys = resource.metadata().get()
+        else:
+            keys = resource.metadata(path + '.').get()
 
-        return resource.metadata(path + '.').get()
+        if cache is not None:
+            cache.set_keys(resource.url(), path, keys, version=version)
 
-    def __setMetadata(self, resource, metadata, path=None):
+        return keys
 
-        if path is None:
-            return resource.metadata().post(data=metadata)
+    def __invalidateMetadata(self, resource, paths):
+        if self._metadata_cache is not None:
+            self._metadata_cache.invalidate(resource.url(), paths=paths)
 
-        data = {}
-        pointer = data
-        tokens = path.split('.')
-        for i in tokens[:-1]:
-            pointer[i] = {}
-            pointer = pointer[i]
-        pointer[tokens[-1]] = metadata
+    @staticmethod
+    def _metadataPaths(metadata, path=None):
+        """Paths of leaves of `metadata` tree"""
+        if (not isinstance(metadata, dict) or not metadata or
+                metadata.get('type', None) == 'file'):
+            return [path]
+        paths = []
+        for key, value in metadata.items():
+            child = key if path is None else path + '.' + key
+            paths.extend(Camomile._metadataPaths(value, path=child))
+        return paths
 
-        return resource.metadata().post(data=data)
+    def __setMetadata(self, resource, metadata, path=None):
+
+        if path is None:
+            data = metadata
+        else:
+            data = {}
+            pointer = data
+            tokens = path.split('.')
+            for i in tokens[:-1]:
+                pointer[i] = {}
+                pointer = pointer[i]
+            pointer[tokens[-1]] = metadata
+
+        try:
+            return resource.metadata().post(data=data)
+        finally:
+            # (after the request, so that concurrent reads are not cached)
+            self.__invalidateMetadata(
+                resource, self._metadataPaths(metadata, path=path))
 
     def __sendMetadataFile(self, resource, metadata_path, file_path):
 
-        with open(file_path, 'rb') as f:
-            content = f.read()
+        # file is base64-encoded while being sent (constant memory)
+        chunks = iter_metadata_file(metadata_path, file_path)
+        try:
+            return self._upload(resource.metadata(), chunks)
+        finally:
+            self.__invalidateMetadata(resource, [metadata_path])
 
-        data = {}
-        pointer = data
-        for i in metadata_path.split('.'):
-            pointer[i] = {}
-            pointer = pointer[i]
+    def __downloadMetadataFile(self, resource, path, dest):
 
-        pointer['type'] = 'file'
-        pointer['filename'] = os.path.basename(file_path)
-        pointer['data'] = b64encode(content).decode()
+        response = self._stream(resource.metadata(path))
+        try:
+            # only rename once complete
+            with open(dest + '.part', 'wb') as f:
+                metadata = write_metadata_file(iter_text(response), f)
+        finally:
+            response.close()
 
-        return resource.metadata().post(data=data)
+        _replace(dest + '.part', dest)
+        return bunchify(metadata)
 
     def __deleteMetadata(self, resource, path):
-        return resource.metadata(path).delete()
+        try:
+            return resource.metadata(path).delete()
+        finally:
+            self.__invalidateMetadata(resource, [path])
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # SSE
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     @CamomileErrorHandling()
     def __startListener(self):
-        if self._thread == None:
+        # caller is expected to hold self._listener_lock
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        # listener thread died: resume listening to the same channel
+        # (whose subscriptions are kept by the server)
+        resumed = self._thread is not None
+
+        if not resumed:
             datas = self._api.listen.post();
             self._channel_id = datas.channel_id
-            self._sseClient = SSEClient("%s/listen/%s" % (self._url, self._channel_id))
-            self._thread = threading.Thread(target=self.__listener, name="SSEClient")
-            self._thread.isRun = True
-            self._thread.daemon = True
-            self._thread.start()
-        return
+
+        # server-sent events stream may stay idle for a long time
+        timeout = getattr(self._transport, 'timeout', None)
+        if isinstance(timeout, tuple):
+            timeout = (timeout[0], None)
+        else:
+            timeout = (timeout, None)
+        self._sseClient = SSEClient(
+            "%s/listen/%s" % (self._url, self._channel_id),
+            session=self._transport, timeout=timeout)
+        self._thread = threading.Thread(target=self.__listener, name="SSEClient")
+        self._thread.isRun = True
+        self._thread.daemon = True
+        self._thread.start()
+
+        if resumed:
+            # events may have been missed in the meantime
+            self._notify('listener', self._channel_id, {'reconnect': True})
+            self.__wakeQueues()
 
 
     def __listener(self):
         t = threading.currentThread()
+        response = None
         for msg in self._sseClient:
             if not t.isRun:
                 break
 
-            if msg.event in self._listenerCallbacks:
-                self._listenerCallbacks[msg.event](json.loads(msg.data)['event'])
+            # SSEClient silently reconnects on failure, possibly missing
+            # events in the meantime: let observers know about it
+            if response is not None and self._sseClient.resp is not response:
+                self._notify('listener', self._channel_id,
+                             {'reconnect': True})
+                self.__wakeQueues()
+            response = self._sseClient.resp
+
+            # copy as callbacks may be (un)registered by another thread
+            callbacks = list(self._listenerCallbacks.get(msg.event, []))
+            for callback in callbacks:
+                # a failing callback must neither stop the listener nor
+                # prevent other callbacks from running
+                try:
+                    callback(json.loads(msg.data)['event'])
+                except Exception as e:
+                    warnings.warn(
+                        'Callback watching {event} failed: {e}'.format(
+                            event=msg.event, e=e))
+
+    def __watch(self, kind, id_, callback):
+        key = kind + ':' + id_
+        with self._listener_lock:
+            self.__startListener()
+            result = self._api.listen(self._channel_id)(kind)(id_).put()
+            if 'event' in result:
+                callbacks = self._listenerCallbacks.setdefault(key, [])
+                if callback not in callbacks:
+                    callbacks.append(callback)
+        return result
+
+    def __wakeQueues(self, queue=None):
+        # wake up threads waiting for `queue` (or for any queue)
+        with self._queue_condition:
+            queues = list(self._queue_pushes) if queue is None else [queue]
+            for q in queues:
+                self._queue_pushes[q] = self._queue_pushes.get(q, 0) + 1
+            self._queue_condition.notify_all()
+
+    def __watchPushes(self, queue):
+        # returns True when queue was not watched yet
+        with self._listener_lock:
+            if queue in self._queue_callbacks:
+                return False
+
+            def callback(event):
+                if 'push_item' in event:
+                    self.__wakeQueues(queue)
+
+            with self._queue_condition:
+                self._queue_pushes.setdefault(queue, 0)
+
+            self.watchQueue(queue, callback)
+            self._queue_callbacks[queue] = callback
+            return True
+
+    def __enterQueue(self, queue):
+        with self._listener_lock:
+            self._queue_waiters[queue] = self._queue_waiters.get(queue, 0) + 1
+
+    def __leaveQueue(self, queue):
+        # stop watching queue once no thread is waiting for it anymore
+        with self._listener_lock:
+            self._queue_waiters[queue] -= 1
+            if self._queue_waiters[queue] > 0:
+                return
+            del self._queue_waiters[queue]
+
+            with self._queue_condition:
+                self._queue_pushes.pop(queue, None)
+
+            callback = self._queue_callbacks.pop(queue, None)
+            if callback is None:
+                return
+            try:
+                self.unwatchQueue(queue, callback=callback)
+            except Exception as e:
+                warnings.warn('Could not unwatch queue {queue}: {e}'.format(
+                    queue=queue, e=e))
+
+    def __unwatch(self, kind, id_, callback=None):
+        key = kind + ':' + id_
+        with self._listener_lock:
+            callbacks = self._listenerCallbacks.get(key, [])
+
+            if callback is not None and callback not in callbacks:
+                raise CamomileNotFound(
+                    'Callback is not watching {kind} {id_}.'.format(
+                        kind=kind, id_=id_))
+
+            if callback is not None and len(callbacks) > 1:
+                # keep watching for remaining callbacks
+                callbacks.remove(callback)
+                result = {'success': 'callback removed'}
+            else:
+                result = self._api.listen(self._channel_id)(kind)(id_).delete()
+                if 'success' in result:
+                    self._listenerCallbacks.pop(key, None)
+
+            # `dequeue` no longer gets notified of pushes
+            if (kind == 'queue' and self._queue_callbacks.get(id_, None)
+                    not in self._listenerCallbacks.get(key, [])):
+                self._queue_callbacks.pop(id_, None)
+
+        return result
 
 
     @CamomileErrorHandling()
@@ -1919,27 +3311,22 @@ class Camomile(object):
         corpus_id : str
             corpus ID
         callback : function
-            callback function
+            callback function.  Several callbacks may watch the same corpus.
         """
-        self.__startListener()
-        result = self._api.listen(self._channel_id).corpus(corpus_id).put()
-        if 'event' in result:
-            self._listenerCallbacks['corpus:' + corpus_id] = callback
-        return result
+        return self.__watch('corpus', corpus_id, callback)
 
     @CamomileErrorHandling()
-    def unwatchCorpus(self, corpus_id):
+    def unwatchCorpus(self, corpus_id, callback=None):
         """ UnWatch corpus
 
         Parameters
         ----------
         corpus_id : str
             corpus ID
+        callback : function, optional
+            Only unregister this callback.  Defaults to all callbacks.
         """
-        result = self._api.listen(self._channel_id).corpus(corpus_id).delete()
-        if 'success' in result:
-            del self._listenerCallbacks['corpus:' + corpus_id]
-        return result
+        return self.__unwatch('corpus', corpus_id, callback=callback)
 
     @CamomileErrorHandling()
     def watchLayer(self, layer_id, callback):
@@ -1953,27 +3340,22 @@ class Camomile(object):
         layer_id : str
             layer ID
         callback : function
-            callback function
+            callback function.  Several callbacks may watch the same layer.
         """
-        self.__startListener()
-        result = self._api.listen(self._channel_id).layer(layer_id).put()
-        if 'event' in result:
-            self._listenerCallbacks['layer:' + layer_id] = callback
-        return result
+        return self.__watch('layer', layer_id, callback)
 
     @CamomileErrorHandling()
-    def unwatchLayer(self, layer_id):
+    def unwatchLayer(self, layer_id, callback=None):
         """ UnWatch layer
 
         Parameters
         ----------
         layer_id : str
             layer ID
+        callback : function, optional
+            Only unregister this callback.  Defaults to all callbacks.
         """
-        result = self._api.listen(self._channel_id).layer(layer_id).delete()
-        if 'success' in result:
-            del self._listenerCallbacks['layer:' + layer_id]
-        return result
+        return self.__unwatch('layer', layer_id, callback=callback)
 
     @CamomileErrorHandling()
     def watchMedium(self, medium_id, callback):
@@ -1986,27 +3368,22 @@ class Camomile(object):
         medium_id : str
             medium ID
         callback : function
-            callback function
+            callback function.  Several callbacks may watch the same medium.
         """
-        self.__startListener()
-        result = self._api.listen(self._channel_id).medium(medium_id).put()
-        if 'event' in result:
-            self._listenerCallbacks['medium:' + medium_id] = callback
-        return result
+        return self.__watch('medium', medium_id, callback)
 
     @CamomileErrorHandling()
-    def unwatchMedium(self, medium_id):
+    def unwatchMedium(self, medium_id, callback=None):
         """ UnWatch medium
 
         Parameters
         ----------
         medium_id : str
             medium ID
+        callback : function, optional
+            Only unregister this callback.  Defaults to all callbacks.
         """
-        result = self._api.listen(self._channel_id).medium(medium_id).delete()
-        if 'success' in result:
-            del self._listenerCallbacks['medium:' + medium_id]
-        return result
+        return self.__unwatch('medium', medium_id, callback=callback)
 
 
     @CamomileErrorHandling()
@@ -2021,27 +3398,22 @@ class Camomile(object):
         queue_id : str
             queue ID
         callback : function
-            callback function
+            callback function.  Several callbacks may watch the same queue.
         """
-        self.__startListener()
-        result = self._api.listen(self._channel_id).queue(queue_id).put()
-        if 'event' in result:
-            self._listenerCallbacks['queue:' + queue_id] = callback
-        return result
+        return self.__watch('queue', queue_id, callback)
 
     @CamomileErrorHandling()
-    def unwatchQueue(self, queue_id):
+    def unwatchQueue(self, queue_id, callback=None):
         """ UnWatch queue
 
         Parameters
         ----------
         queue_id : str
             queue ID
+        callback : function, optional
+            Only unregister this callback.  Defaults to all callbacks.
         """
-        result = self._api.listen(self._channel_id).queue(queue_id).delete()
-        if 'success' in result:
-            del self._listenerCallbacks['queue:' + queue_id]
-        return result
+        return self.__unwatch('queue', queue_id, callback=callback)
 
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
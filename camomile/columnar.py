@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Columnar storage of segment annotations"""
+
+import array
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class _Encoder(object):
+    """Dictionary encoder (value --> integer code)"""
+
+    def __init__(self, values=None):
+        super(_Encoder, self).__init__()
+        self.values = []
+        self.codes = {}
+        for value in (values or []):
+            self(value)
+
+    @staticmethod
+    def _key(value):
+        # dictionaries and lists are not hashable
+        try:
+            hash(value)
+        except TypeError:
+            return json.dumps(value, sort_keys=True)
+        return value
+
+    def __call__(self, value):
+        key = self._key(value)
+        code = self.codes.get(key, None)
+        if code is None:
+            code = len(self.values)
+            self.codes[key] = code
+            self.values.append(value)
+        return code
+
+
+def _columns(annotations, labels, media):
+    """Split segment annotations into columns
+
+    Parameters
+    ----------
+    annotations : iterable
+        Annotations (consumed only once, one annotation at a time).
+    labels, media : _Encoder
+        Encoders of annotation data and medium.
+
+    Returns
+    -------
+    start, end, label, medium : np.ndarray
+    ids : list
+    """
+
+    # compact (C-typed) buffers rather than lists of Python floats
+    start, end = array.array('d'), array.array('d')
+    label, medium = array.array('i'), array.array('i')
+    ids = []
+
+    for annotation in annotations:
+        fragment = annotation.get('fragment', None) or {}
+        try:
+            start.append(fragment['start'])
+            end.append(fragment['end'])
+        except (KeyError, TypeError):
+            raise ValueError(
+                'AnnotationArray only supports segment annotations.')
+        label.append(labels(annotation.get('data', None)))
+        medium.append(media(annotation.get('id_medium', None)))
+        ids.append(annotation.get('_id', None))
+
+    return (np.frombuffer(start, dtype=np.float64),
+            np.frombuffer(end, dtype=np.float64),
+            np.frombuffer(label, dtype=np.intc),
+            np.frombuffer(medium, dtype=np.intc),
+            ids)
+
+
+class AnnotationArray(object):
+    """Columnar container for segment annotations
+
+    Stores annotations of segment layers (whose fragment is a
+    {'start': ..., 'end': ...} dictionary) as NumPy arrays, with data
+    (e.g. labels) and media dictionary-encoded.
+
+    Requires `numpy`.
+
+    Parameters
+    ----------
+    start, end : array-like
+        (n, ) segments start and end times.
+    label : array-like
+        (n, ) codes of annotation data, i.e. indices in `labels`.
+    labels : list
+        Distinct annotation data.
+    medium : array-like
+        (n, ) codes of annotation medium, i.e. indices in `media`.
+    media : list
+        Distinct medium IDs.
+    id : array-like, optional
+        (n, ) annotations IDs.  Defaults to None for all annotations.
+    media_names : list, optional
+        Medium names, in the same order as `media`.
+
+    Example
+    -------
+    >>> annotations = client.getAnnotations(layer=layer, returns_array=True)
+    >>> duration = annotations.end - annotations.start
+    >>> # total duration per label
+    >>> np.bincount(annotations.label, weights=duration)
+    """
+
+    def __init__(self, start, end, label, labels, medium, media, id=None,
+                 media_names=None):
+        super(AnnotationArray, self).__init__()
+
+        if np is None:
+            raise ImportError('AnnotationArray requires numpy.')
+
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.label = np.asarray(label, dtype=np.int32)
+        self.labels = list(labels)
+        self.medium = np.asarray(medium, dtype=np.int32)
+        self.media = list(media)
+
+        if id is None:
+            id = [None] * len(self.start)
+        id = np.asarray(id)
+        # fixed-width strings may be memory-mapped (see `load`)
+        if id.dtype.kind != 'U':
+            id = id.astype(object)
+        self.id = id
+
+        self.media_names = None if media_names is None else list(media_names)
+
+        n = len(self.start)
+        if not (len(self.end) == len(self.label) == len(self.medium) ==
+                len(self.id) == n):
+            raise ValueError('All columns must have the same length.')
+
+    @classmethod
+    def from_annotations(cls, annotations):
+        """Build columnar container from annotations
+
+        Parameters
+        ----------
+        annotations : iterable
+            Annotations, as returned by `Camomile.getAnnotations` or
+            `Camomile.iterAnnotations`.  Consumed only once, one annotation
+            at a time.
+
+        Returns
+        -------
+        annotations : AnnotationArray
+        """
+
+        labels, media = _Encoder(), _Encoder()
+        start, end, label, medium, ids = _columns(annotations, labels, media)
+        return cls(start, end, label, labels.values, medium, media.values,
+                   id=ids)
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """Concatenate several columnar containers into one"""
+
+        arrays = list(arrays)
+        labels, media = _Encoder(), _Encoder()
+
+        names = {}
+        for a in arrays:
+            if a.media_names is not None:
+                names.update(zip(a.media, a.media_names))
+
+        label, medium = [], []
+        for a in arrays:
+            # re-encode codes with the merged dictionaries
+            label.append(np.array([labels(l) for l in a.labels],
+                                  dtype=np.int32)[a.label])
+            medium.append(np.array([media(m) for m in a.media],
+                                   dtype=np.int32)[a.medium])
+
+        if not arrays:
+            return cls([], [], [], [], [], [])
+
+        media_names = None
+        if names:
+            media_names = [names.get(m, None) for m in media.values]
+
+        return cls(np.concatenate([a.start for a in arrays]),
+                   np.concatenate([a.end for a in arrays]),
+                   np.concatenate(label), labels.values,
+                   np.concatenate(medium), media.values,
+                   id=np.concatenate([a.id for a in arrays]),
+                   media_names=media_names)
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, index):
+        """Select annotations (by slice, boolean mask or indices)"""
+        return self.__class__(self.start[index], self.end[index],
+                              self.label[index], self.labels,
+                              self.medium[index], self.media,
+                              id=self.id[index],
+                              media_names=self.media_names)
+
+    def __iter__(self):
+        return self.to_annotations()
+
+    def __repr__(self):
+        return '<AnnotationArray: {n:d} annotations, {l:d} labels, {m:d} media>'.format(
+            n=len(self), l=len(self.labels), m=len(self.media))
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def for_medium(self, medium):
+        """Select annotations of one medium
+
+        Parameters
+        ----------
+        medium : str
+            Medium ID.
+        """
+        try:
+            code = self.media.index(medium)
+        except ValueError:
+            return self[np.zeros((len(self), ), dtype=bool)]
+        return self[self.medium == code]
+
+    def save(self, path, format=None):
+        """Save to columnar file
+
+        Parameters
+        ----------
+        path : str
+        format : {'npz', 'parquet', 'arrow'}, optional
+            'npz' is an uncompressed NumPy archive.  'parquet' and 'arrow'
+            (Arrow IPC file) require `pyarrow`.  Defaults to guessing from
+            `path` extension.
+
+        See also
+        --------
+        `load`, `Camomile.exportLayer`
+        """
+        from .export import save
+        save(self, path, format=format)
+
+    @classmethod
+    def load(cls, path, format=None):
+        """Load columnar file
+
+        'npz' and 'arrow' files are memory-mapped: opening them is
+        instantaneous whatever their size, and processes loading the same
+        file share the same memory pages.
+
+        Parameters
+        ----------
+        path : str
+        format : {'npz', 'parquet', 'arrow'}, optional
+            Defaults to guessing from `path` extension.
+
+        Returns
+        -------
+        annotations : AnnotationArray
+        """
+        from .export import load
+        return load(path, format=format)
+
+    def to_annotations(self, with_id=True):
+        """Iterate over annotations (as dictionaries)
+
+        Parameters
+        ----------
+        with_id : boolean, optional
+            Set to False to not include annotation IDs.  Defaults to True.
+
+        Returns
+        -------
+        annotations : iterator
+            Iterator over annotations with 'id_medium', 'fragment', 'data'
+            (and '_id' if available) keys, suitable for
+            `Camomile.createAnnotations`.
+        """
+        for i in range(len(self)):
+            annotation = {
+                'id_medium': self.media[self.medium[i]],
+                'fragment': {'start': float(self.start[i]),
+                             'end': float(self.end[i])},
+                'data': self.labels[self.label[i]]}
+            if with_id and self.id[i] is not None:
+                annotation['_id'] = self.id[i]
+            yield annotation
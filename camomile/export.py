@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Columnar files (NumPy, Parquet, Arrow) of segment annotations"""
+
+import json
+import os
+import struct
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from .bulk import chunks
+from .columnar import AnnotationArray, _Encoder, _columns
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+FORMATS = {'.npz': 'npz', '.parquet': 'parquet', '.arrow': 'arrow',
+           '.feather': 'arrow'}
+
+# schema metadata key telling that labels are JSON-encoded
+JSON_LABELS = b'camomile.labels.json'
+
+
+def guess_format(path, format=None):
+    """Check `format` (or guess it from `path` extension)"""
+    if format is None:
+        _, extension = os.path.splitext(path)
+        try:
+            format = FORMATS[extension.lower()]
+        except KeyError:
+            raise ValueError(
+                'Cannot guess format of "{path}".'.format(path=path))
+    if format not in ('npz', 'parquet', 'arrow'):
+        raise ValueError('Unsupported format "{format}".'.format(
+            format=format))
+    if format != 'npz' and pa is None:
+        raise ImportError('{format} format requires pyarrow.'.format(
+            format=format.capitalize()))
+    return format
+
+
+def _has_id(annotations):
+    return len(annotations) > 0 and not any(i is None for i in annotations.id)
+
+
+def save(annotations, path, format=None):
+    """Save annotations to columnar file
+
+    Labels and media are dictionary-encoded: each distinct label (or medium)
+    is stored only once.
+
+    Parameters
+    ----------
+    annotations : AnnotationArray
+    path : str
+    format : {'npz', 'parquet', 'arrow'}, optional
+        Defaults to guessing from `path` extension.
+    """
+
+    format = guess_format(path, format=format)
+    if format == 'npz':
+        _save_npz(annotations, path)
+    else:
+        _save_arrow(annotations, path, format)
+
+
+def export(annotations, path, format=None, media_names=None,
+           batch_size=65536):
+    """Stream annotations to columnar file
+
+    Parquet and Arrow files are written one record batch of `batch_size`
+    annotations at a time, while `annotations` are consumed.  NPZ archives
+    cannot be appended to: their (compact) columns are built in memory
+    first.
+
+    Labels are always JSON-encoded, as their types are unknown in advance.
+
+    Parameters
+    ----------
+    annotations : iterable
+        Segment annotations (e.g. `Camomile.iterAnnotations`).
+    path : str
+    format : {'npz', 'parquet', 'arrow'}, optional
+        Defaults to guessing from `path` extension.
+    media_names : dict, optional
+        Medium ID --> medium name dictionary.
+    batch_size : int, optional
+        Defaults to 65536 annotations.
+
+    Returns
+    -------
+    n : int
+        Number of exported annotations.
+    """
+
+    format = guess_format(path, format=format)
+
+    def names(media):
+        return [media_names.get(m, None) for m in media]
+
+    if format == 'npz':
+        annotations = AnnotationArray.from_annotations(annotations)
+        if media_names is not None:
+            annotations.media_names = names(annotations.media)
+        _save_npz(annotations, path)
+        return len(annotations)
+
+    labels, media = _Encoder(), _Encoder()
+    writer = _ArrowWriter(path, format, json_labels=True,
+                          with_names=media_names is not None, with_id=True)
+
+    n = 0
+    try:
+        for chunk in chunks(annotations, batch_size):
+            start, end, label, medium, ids = _columns(chunk, labels, media)
+            # dictionaries only grow from one batch to the next
+            writer.write(start, end, label, labels.values,
+                         medium, media.values,
+                         names=None if media_names is None else names(
+                             media.values),
+                         ids=ids)
+            n += len(start)
+    finally:
+        writer.close()
+
+    return n
+
+
+def load(path, format=None):
+    """Load annotations from columnar file (memory-mapped when possible)
+
+    Parameters
+    ----------
+    path : str
+    format : {'npz', 'parquet', 'arrow'}, optional
+        Defaults to guessing from `path` extension.
+
+    Returns
+    -------
+    annotations : AnnotationArray
+    """
+
+    format = guess_format(path, format=format)
+    if format == 'npz':
+        return _load_npz(path)
+    return _load_arrow(path, format)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# NPZ
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def _save_strings(arrays, name, values):
+    # fixed-width unicode array (object arrays cannot be memory-mapped)
+    # with missing values (None) flagged in a companion boolean array
+    values = list(values)
+    arrays[name] = np.array([u'' if v is None else v for v in values],
+                            dtype=np.str_)
+    missing = np.array([v is None for v in values], dtype=bool)
+    if missing.any():
+        arrays[name + '.null'] = missing
+
+
+def _load_strings(arrays, name):
+    values = arrays[name].tolist()
+    missing = arrays.get(name + '.null', None)
+    if missing is not None:
+        values = [None if m else v for v, m in zip(values, missing)]
+    return values
+
+
+def _save_npz(annotations, path):
+
+    arrays = {
+        'start': annotations.start,
+        'end': annotations.end,
+        'label': annotations.label,
+        'medium': annotations.medium,
+    }
+
+    _save_strings(arrays, 'labels', (json.dumps(l) for l in annotations.labels))
+    _save_strings(arrays, 'media', annotations.media)
+
+    if annotations.media_names is not None:
+        _save_strings(arrays, 'media_names', annotations.media_names)
+
+    if _has_id(annotations):
+        _save_strings(arrays, 'id', annotations.id)
+
+    # np.savez stores arrays uncompressed, so that they can be memory-mapped
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _memmap_npz(path):
+    """Memory-map all arrays of an uncompressed .npz file"""
+
+    arrays = {}
+
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+
+        for info in archive.infolist():
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('Cannot memory-map compressed archive.')
+
+            # skip local file header (its extra field may differ from the
+            # one of the central directory)
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if header[:4] != b'PK\x03\x04':
+                raise ValueError('Invalid archive.')
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-4]
+
+            if dtype.hasobject:
+                raise ValueError('Cannot memory-map object arrays.')
+
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                     offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+
+    return arrays
+
+
+def _load_npz(path):
+
+    arrays = _memmap_npz(path)
+
+    media_names = None
+    if 'media_names' in arrays:
+        media_names = _load_strings(arrays, 'media_names')
+
+    return AnnotationArray(
+        arrays['start'], arrays['end'], arrays['label'],
+        [json.loads(l) for l in _load_strings(arrays, 'labels')],
+        arrays['medium'], _load_strings(arrays, 'media'),
+        id=arrays.get('id', None), media_names=media_names)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# PARQUET / ARROW
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def _dictionary(codes, values):
+    """Dictionary-encoded column with missing values (None) as null codes
+
+    (pyarrow cannot write dictionaries containing null values)
+    """
+
+    codes = np.asarray(codes, dtype=np.int32)
+    present = np.array([v is not None for v in values], dtype=bool)
+
+    if present.all():
+        indices = pa.array(codes, type=pa.int32())
+    else:
+        # shift codes of values following missing ones
+        shifted = np.cumsum(present, dtype=np.int32) - 1
+        indices = pa.array(shifted[codes], type=pa.int32(),
+                           mask=~present[codes])
+
+    return pa.DictionaryArray.from_arrays(
+        indices, pa.array([v for v in values if v is not None],
+                          type=pa.string()))
+
+
+class _ArrowWriter(object):
+    """Write Parquet or Arrow file, one record batch at a time
+
+    Dictionaries (labels, media and medium names) of successive batches
+    must extend the ones of previous batches, so that they can be written
+    as deltas in Arrow files.
+    """
+
+    def __init__(self, path, format, json_labels=False, with_names=False,
+                 with_id=False):
+        super(_ArrowWriter, self).__init__()
+
+        self.json_labels = json_labels
+        self.with_names = with_names
+        self.with_id = with_id
+
+        # JSON-encoded labels of previous batches
+        self._labels = []
+
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        fields = [('start', pa.float64()), ('end', pa.float64()),
+                  ('label', dictionary), ('medium', dictionary)]
+        if with_names:
+            fields.append(('medium_name', dictionary))
+        if with_id:
+            fields.append(('id', pa.string()))
+
+        metadata = {JSON_LABELS: b'1'} if json_labels else None
+        self.schema = pa.schema(fields, metadata=metadata)
+
+        if format == 'parquet':
+            self._file = None
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            # uncompressed, so that it can be memory-mapped
+            self._file = pa.OSFile(path, 'wb')
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self._writer = pa.ipc.new_file(self._file, self.schema,
+                                           options=options)
+
+    def write(self, start, end, label, labels, medium, media, names=None,
+              ids=None):
+
+        if self.json_labels:
+            self._labels.extend(json.dumps(l)
+                                for l in labels[len(self._labels):])
+            labels = self._labels
+
+        columns = [pa.array(start, type=pa.float64()),
+                   pa.array(end, type=pa.float64()),
+                   _dictionary(label, labels),
+                   _dictionary(medium, media)]
+        if self.with_names:
+            columns.append(_dictionary(medium, names))
+        if self.with_id:
+            columns.append(pa.array(list(ids), type=pa.string()))
+
+        self._writer.write_batch(
+            pa.record_batch(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def _save_arrow(annotations, path, format):
+
+    # keep labels human-readable when they are all strings
+    json_labels = not all(isinstance(l, string_types)
+                          for l in annotations.labels)
+
+    writer = _ArrowWriter(path, format, json_labels=json_labels,
+                          with_names=annotations.media_names is not None,
+                          with_id=_has_id(annotations))
+    try:
+        writer.write(annotations.start, annotations.end,
+                     annotations.label, annotations.labels,
+                     annotations.medium, annotations.media,
+                     names=annotations.media_names, ids=annotations.id)
+    finally:
+        writer.close()
+
+
+def _load_arrow(path, format):
+
+    if format == 'parquet':
+        # parquet pages are encoded, hence cannot be used in place
+        table = pq.read_table(path, memory_map=True)
+    else:
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    metadata = table.schema.metadata or {}
+    json_labels = JSON_LABELS in metadata
+
+    def numbers(name):
+        column = table.column(name)
+        if column.num_chunks == 1:
+            # zero-copy
+            return column.chunk(0).to_numpy()
+        return column.to_numpy()
+
+    def dictionary(name):
+        column = table.column(name)
+        if column.num_chunks == 1:
+            column = column.chunk(0)
+        else:
+            column = column.unify_dictionaries().combine_chunks()
+        indices = column.indices
+        values = column.dictionary.to_pylist()
+        if indices.null_count:
+            # missing values are encoded as null codes
+            indices = indices.fill_null(len(values))
+            values.append(None)
+        return indices.to_numpy(), values
+
+    label, labels = dictionary('label')
+    if json_labels:
+        labels = [None if l is None else json.loads(l) for l in labels]
+
+    medium, media = dictionary('medium')
+
+    media_names = None
+    if 'medium_name' in table.column_names:
+        # medium names are not encoded in the same order as media
+        name, names = dictionary('medium_name')
+        codes = np.full((len(media), ), -1, dtype=np.int64)
+        codes[medium] = name
+        media_names = [names[c] if c >= 0 else None for c in codes.tolist()]
+
+    id_ = None
+    if 'id' in table.column_names:
+        id_ = table.column('id').to_numpy()
+
+    return AnnotationArray(numbers('start'), numbers('end'), label, labels,
+                           medium, media, id=id_, media_names=media_names)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Time index over segment annotations"""
+
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+
+def _bucket(duration):
+    # order of magnitude of segment duration: 2 ** (b - 1) <= duration < 2 ** b
+    return math.frexp(duration)[1]
+
+
+def _annotation_id(annotation):
+    # events may either carry the whole annotation or only its ID
+    if isinstance(annotation, dict):
+        return annotation['_id']
+    return annotation
+
+
+class IntervalIndex(object):
+    """Time index over segment annotations of one medium of one layer
+
+    Annotations are kept sorted by start time and by end time.  They are
+    also grouped by order of magnitude of their duration, each group being
+    sorted by start time, so that time-range queries cost O(b log n) (plus
+    the number of returned segments) where b is the number of groups: a few
+    long segments do not slow down queries over many short ones.
+
+    Indexes obtained with `Camomile.getIntervalIndex` are kept up to date
+    with annotations created, updated or deleted through the same client.
+
+    Parameters
+    ----------
+    annotations : iterable, optional
+        Segment annotations (whose fragment is a {'start': ..., 'end': ...}
+        dictionary) to index.
+    layer, medium : str, optional
+        Layer and medium IDs.  Used to filter changes notified by the client.
+
+    Example
+    -------
+    >>> index = client.getIntervalIndex(layer, medium)
+    >>> index.overlapping(10., 20.)
+    >>> index.nearest(42.)
+    """
+
+    def __init__(self, annotations=(), layer=None, medium=None):
+        super(IntervalIndex, self).__init__()
+
+        self.layer = layer
+        self.medium = medium
+
+        self._lock = threading.RLock()
+
+        self._annotations = {}
+        for annotation in annotations:
+            self._annotations[annotation['_id']] = annotation
+
+        # sort once rather than inserting one annotation at a time
+        self._starts = sorted((a['fragment']['start'], i)
+                              for i, a in self._annotations.items())
+        self._ends = sorted((a['fragment']['end'], i)
+                            for i, a in self._annotations.items())
+
+        # duration group --> annotations sorted by start time
+        self._buckets = {}
+        # duration group --> upper bound of segments duration
+        self._durations = {}
+        for start, i in self._starts:
+            duration = self._annotations[i]['fragment']['end'] - start
+            b = _bucket(duration)
+            self._buckets.setdefault(b, []).append((start, i))
+            self._durations[b] = max(self._durations.get(b, duration),
+                                     duration)
+
+    def __len__(self):
+        return len(self._annotations)
+
+    def __contains__(self, annotation):
+        return _annotation_id(annotation) in self._annotations
+
+    def __iter__(self):
+        """Iterate over annotations, sorted by start time"""
+        with self._lock:
+            annotations = [self._annotations[i] for _, i in self._starts]
+        for annotation in annotations:
+            yield annotation
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # UPDATES
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def add(self, annotation):
+        """Add (or replace) annotation"""
+
+        with self._lock:
+
+            i = annotation['_id']
+            if i in self._annotations:
+                self.remove(i)
+
+            start = annotation['fragment']['start']
+            end = annotation['fragment']['end']
+
+            self._annotations[i] = annotation
+            insort(self._starts, (start, i))
+            insort(self._ends, (end, i))
+
+            b = _bucket(end - start)
+            insort(self._buckets.setdefault(b, []), (start, i))
+            self._durations[b] = max(self._durations.get(b, end - start),
+                                     end - start)
+
+    def remove(self, annotation):
+        """Remove annotation (annotation dictionary or ID)
+
+        Returns
+        -------
+        removed : boolean
+            False when annotation was not indexed.
+        """
+
+        with self._lock:
+
+            i = _annotation_id(annotation)
+            annotation = self._annotations.pop(i, None)
+            if annotation is None:
+                return False
+
+            start = annotation['fragment']['start']
+            end = annotation['fragment']['end']
+            del self._starts[bisect_left(self._starts, (start, i))]
+            del self._ends[bisect_left(self._ends, (end, i))]
+
+            b = _bucket(end - start)
+            bucket = self._buckets[b]
+            del bucket[bisect_left(bucket, (start, i))]
+            if not bucket:
+                del self._buckets[b]
+                del self._durations[b]
+
+            return True
+
+    def on_event(self, kind, id_, event):
+        """Apply change notified by the client (or server-sent events)
+
+        Parameters
+        ----------
+        kind : str
+            Resource type (e.g. 'layer').
+        id_ : str
+            Resource ID.  None when unknown.
+        event : dict
+            e.g. {'add_annotation': annotation}
+        """
+
+        if kind != 'layer' or id_ not in (None, self.layer):
+            return
+
+        for name, annotation in event.items():
+
+            if name == 'delete_annotation':
+                self.remove(annotation)
+                continue
+
+            if name not in ('add_annotation', 'update_annotation'):
+                continue
+
+            if not isinstance(annotation, dict):
+                continue
+
+            if (self.medium is not None and
+                    annotation.get('id_medium', None) != self.medium):
+                # annotation may have been moved to another medium
+                self.remove(annotation)
+                continue
+
+            # layer is only implied for updates
+            if name == 'update_annotation' and annotation['_id'] not in self:
+                if annotation.get('id_layer', None) != self.layer:
+                    continue
+
+            self.add(annotation)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # QUERIES
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _candidates(self, t, upper):
+        """Annotations that may end after `t`, among those starting before
+        `upper` (excluded), sorted by start time"""
+
+        candidates = []
+        for b, bucket in self._buckets.items():
+            # within a group, only segments starting less than the longest
+            # duration of the group before `t` may end after `t`
+            lo = bisect_left(bucket, (t - self._durations[b], ))
+            hi = bisect_left(bucket, upper)
+            candidates.extend(bucket[lo:hi])
+        candidates.sort()
+        return [self._annotations[i] for _, i in candidates]
+
+    def overlapping(self, start, end):
+        """Get annotations overlapping [start, end] time range
+
+        Returns
+        -------
+        annotations : list
+            Annotations such that annotation start < `end` and
+            annotation end > `start`, sorted by start time.
+        """
+
+        with self._lock:
+            candidates = self._candidates(start, (end, ))
+
+        return [a for a in candidates if a['fragment']['end'] > start]
+
+    def at(self, t):
+        """Get annotations active at time `t` (start <= `t` < end)"""
+
+        with self._lock:
+            candidates = self._candidates(t, (t, u'\uffff'))
+
+        return [a for a in candidates if a['fragment']['end'] > t]
+
+    def contained(self, start, end):
+        """Get annotations fully contained in [start, end] time range
+
+        Returns
+        -------
+        annotations : list
+            Annotations such that annotation start >= `start` and
+            annotation end <= `end`, sorted by start time.
+        """
+
+        with self._lock:
+            lo = bisect_left(self._starts, (start, ))
+            hi = bisect_left(self._starts, (end, ))
+            candidates = [self._annotations[i]
+                          for _, i in self._starts[lo:hi]]
+
+        return [a for a in candidates if a['fragment']['end'] <= end]
+
+    def nearest(self, t):
+        """Get annotation closest to time `t`
+
+        Returns
+        -------
+        annotation : dict
+            Annotation active at time `t` if any (the one starting first),
+            closest annotation otherwise.  None if the index is empty.
+        """
+
+        active = self.at(t)
+        if active:
+            return active[0]
+
+        with self._lock:
+
+            # first annotation starting after t
+            i = bisect_left(self._starts, (t, ))
+            after = self._starts[i] if i < len(self._starts) else None
+
+            # last annotation ending before t
+            j = bisect_right(self._ends, (t, u'\uffff')) - 1
+            before = self._ends[j] if j >= 0 else None
+
+            if after is None and before is None:
+                return None
+
+            if after is None or (before is not None and
+                                 t - before[0] <= after[0] - t):
+                return self._annotations[before[1]]
+
+            return self._annotations[after[1]]
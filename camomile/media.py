@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Download (and caching) of media files"""
+
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where open files cannot be removed anyway
+    fcntl = None
+
+import requests
+
+from .bulk import parallel_imap_unordered
+
+
+# errors after which a download can be resumed
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def _replace(source, destination):
+    # os.replace is not available in Python 2
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def _size(session, url):
+    """Get size of remote file (None when ranges are not supported)"""
+
+    response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+    try:
+        response.raise_for_status()
+        match = re.match(r'bytes\s+0-0/(\d+)',
+                         response.headers.get('Content-Range', ''))
+        if response.status_code != 206 or match is None:
+            return None
+        return int(match.group(1))
+    finally:
+        response.close()
+
+
+def _download_sequential(session, url, part, chunk_size, max_retries):
+
+    trial = 0
+    while True:
+
+        # resume where previous attempt stopped
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': 'bytes={0:d}-'.format(offset)} if offset else {}
+
+        try:
+            response = session.get(url, headers=headers, stream=True)
+            try:
+                # range starts at the end of the file: already complete
+                if offset and response.status_code == 416:
+                    return
+                response.raise_for_status()
+
+                # server may ignore the range and send the whole file
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                return
+
+            finally:
+                response.close()
+
+        except RESUMABLE_ERRORS:
+            if trial >= max_retries:
+                raise
+            time.sleep(2 ** trial)
+            trial += 1
+
+
+def _download_parallel(session, url, part, size, chunk_size, piece_size,
+                       parallel, max_retries):
+
+    # offsets of already downloaded pieces, one per line
+    log = part + '.done'
+
+    done = set()
+    if os.path.exists(part) and os.path.exists(log):
+        with open(log, 'r') as f:
+            done = set(int(line) for line in f if line.strip())
+    else:
+        with open(part, 'wb') as f:
+            f.truncate(size)
+
+    def fetch(offset):
+        end = min(offset + piece_size, size) - 1
+        headers = {'Range': 'bytes={0:d}-{1:d}'.format(offset, end)}
+        response = session.get(url, headers=headers, stream=True)
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError('Server does not support range requests.')
+            written = 0
+            with open(part, 'r+b') as f:
+                f.seek(offset)
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        finally:
+            response.close()
+        if written != end - offset + 1:
+            raise requests.exceptions.ChunkedEncodingError(
+                'Incomplete range {0:d}-{1:d}.'.format(offset, end))
+        return offset
+
+    pieces = (offset for offset in range(0, size, piece_size)
+              if offset not in done)
+
+    with open(log, 'a') as f:
+        for offset, _ in parallel_imap_unordered(
+                fetch, pieces, max_workers=parallel, max_retries=max_retries,
+                retry_on=RESUMABLE_ERRORS):
+            f.write('{0:d}\n'.format(offset))
+            f.flush()
+
+    os.remove(log)
+
+
+def download(session, url, path, chunk_size=1 << 20, parallel=1,
+             piece_size=1 << 24, max_retries=3):
+    """Download file, in constant memory, resuming interrupted downloads
+
+    Data is first written to `path` + '.part', which is only renamed to
+    `path` once complete.  Downloads interrupted by a connection error are
+    resumed with HTTP Range requests (right away, up to `max_retries` times,
+    or when calling `download` again later).
+
+    Parameters
+    ----------
+    session : requests.Session
+    url : str
+    path : str
+        Path to downloaded file.
+    chunk_size : int, optional
+        Data is written to disk in chunks of `chunk_size` bytes.
+        Defaults to 1MB.
+    parallel : int, optional
+        When greater than 1, the file is split into pieces of `piece_size`
+        bytes, fetched `parallel` at a time.  Only used when the server
+        supports Range requests.  Defaults to 1.
+    piece_size : int, optional
+        Defaults to 16MB.
+    max_retries : int, optional
+        Defaults to 3.
+    """
+
+    part = path + '.part'
+
+    # parallel download can only resume a previous parallel download
+    size = None
+    if parallel > 1 and (not os.path.exists(part) or
+                         os.path.exists(part + '.done')):
+        size = _size(session, url)
+
+    if size is not None and size > piece_size:
+        _download_parallel(session, url, part, size, chunk_size, piece_size,
+                           parallel, max_retries)
+    else:
+        # sparse file left by a parallel download cannot be resumed here
+        if os.path.exists(part + '.done'):
+            os.remove(part)
+            os.remove(part + '.done')
+        _download_sequential(session, url, part, chunk_size, max_retries)
+
+    _replace(part, path)
+
+
+def _lock(f, exclusive=False, blocking=True):
+    """Lock open file (returns False when it is already locked)"""
+
+    if fcntl is None:
+        return True
+
+    operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+
+    try:
+        fcntl.flock(f.fileno(), operation)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+            return False
+        raise
+    return True
+
+
+class MediaCache(object):
+    """Local cache of media files, with a bounded size
+
+    Media are downloaded once (see `Camomile.downloadMedium`) and then read
+    from disk.  Cached files are keyed by medium ID, format and medium URL
+    (so that a medium pointing to a new file is downloaded again).  Least
+    recently used files are removed as soon as the cache grows larger than
+    `max_bytes`.
+
+    Files are downloaded under a temporary name then atomically renamed,
+    so that any number of processes can share the same cache directory:
+    they never see partial files.  Files used within a `lease` are never
+    removed, by any process.  Temporary files left by interrupted downloads
+    count toward `max_bytes` and are removed once `stale_after` seconds
+    old.
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    root : str, optional
+        Cache directory.  Defaults to ~/.camomile/media.
+    max_bytes : int, optional
+        Maximum size of the cache, in bytes.  Defaults to 10GB.
+    parallel : int, optional
+        See `Camomile.downloadMedium`.  Defaults to 1.
+    stale_after : float, optional
+        Temporary files not modified for that many seconds are considered
+        abandoned.  Defaults to one hour.
+
+    Example
+    -------
+    >>> cache = MediaCache(client, max_bytes=50 * 2 ** 30)
+    >>> for medium in client.getMedia(corpus=corpus):
+    ...     with cache.lease(medium, format='wav') as path:
+    ...         features = extract(path)
+    """
+
+    def __init__(self, client, root=None, max_bytes=10 * 2 ** 30,
+                 parallel=1, stale_after=3600.):
+        super(MediaCache, self).__init__()
+
+        if root is None:
+            root = os.path.join(os.path.expanduser('~'), '.camomile',
+                                'media')
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(root):
+                    raise
+
+        self.client = client
+        self.root = root
+        self.max_bytes = max_bytes
+        self.parallel = parallel
+        self.stale_after = stale_after
+
+    def _path(self, medium, format):
+        key = json.dumps([self.client._url, medium['_id'], format,
+                          medium.get('url', None)])
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, '{key}.{format}'.format(
+            key=key, format=format))
+
+    def _open(self, medium, format):
+        """Open (and share-lock) cached file, downloading it if needed
+
+        Returns
+        -------
+        path : str
+        f : file
+            Open file.  Closing it releases the lock.
+        """
+
+        if not isinstance(medium, dict):
+            medium = self.client.getMedium(medium)
+
+        if format is None:
+            format = 'video'
+
+        path = self._path(medium, format)
+
+        while True:
+
+            try:
+                f = open(path, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self._download(medium, format, path)
+                continue
+
+            _lock(f)
+
+            # file may have been evicted between `open` and `_lock`
+            try:
+                same = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+            except OSError:
+                same = False
+            if not same:
+                f.close()
+                continue
+
+            # mark as recently used
+            os.utime(path, None)
+            return path, f
+
+    def _download(self, medium, format, path):
+
+        # unique temporary name, as other processes may be downloading the
+        # same medium at the same time
+        tmp = '{path}.{uuid}.tmp'.format(path=path, uuid=uuid.uuid4().hex)
+        try:
+            self.client.downloadMedium(medium['_id'], tmp, format=format,
+                                       parallel=self.parallel)
+            _replace(tmp, path)
+        finally:
+            for garbage in (tmp, tmp + '.part', tmp + '.part.done'):
+                if os.path.exists(garbage):
+                    os.remove(garbage)
+
+        self.evict(keep=path)
+
+    def get(self, medium, format=None):
+        """Get path to local copy of medium
+
+        The file is only guaranteed to exist when `get` returns: another
+        process may evict it at any time afterwards.  Use `lease` instead
+        to keep it around while using it.
+
+        Parameters
+        ----------
+        medium : str or dict
+            Medium ID (or medium, as returned by `Camomile.getMedium`,
+            which saves one request).
+        format : {'webm', 'mp4', 'ogv', 'mp3', 'wav'}, optional
+            Streaming format.
+
+        Returns
+        -------
+        path : str
+            Path to cached file.
+        """
+
+        path, f = self._open(medium, format)
+        f.close()
+        return path
+
+    @contextlib.contextmanager
+    def lease(self, medium, format=None):
+        """Get path to local copy of medium, protected from eviction
+
+        Parameters
+        ----------
+        medium, format :
+            See `get`.
+
+        Example
+        -------
+        >>> with cache.lease(medium, format='wav') as path:
+        ...     features = extract(path)
+        """
+
+        path, f = self._open(medium, format)
+        try:
+            yield path
+        finally:
+            f.close()
+
+    @staticmethod
+    def _temporary(name):
+        return name.endswith(('.tmp', '.part', '.done'))
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # evicted by another process meanwhile
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    @property
+    def size(self):
+        """Total size of cached (and temporary) files, in bytes"""
+        return sum(size for _, size, _ in self._files())
+
+    def _remove(self, path):
+        """Remove file unless it is leased (returns True when removed)"""
+
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return False
+
+        try:
+            if not _lock(f, exclusive=True, blocking=False):
+                return False
+            # processes that opened it without a lease keep their
+            # (POSIX) file handle
+            os.remove(path)
+        except OSError:
+            return False
+        finally:
+            f.close()
+
+        return True
+
+    def evict(self, keep=None):
+        """Remove stale temporary files, then least recently used files
+        until size fits `max_bytes`
+
+        Parameters
+        ----------
+        keep : str, optional
+            Never remove this file.
+        """
+
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+
+        now = time.time()
+        cached = []
+        for mtime, size, path in files:
+            if not self._temporary(path):
+                cached.append((size, path))
+            elif now - mtime > self.stale_after:
+                # left by an interrupted download
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+        for size, path in cached:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            if self._remove(path):
+                total -= size
+
+    def clear(self):
+        """Remove all cached files (except leased ones)"""
+        for _, _, path in self._files():
+            if not self._temporary(path):
+                self._remove(path)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""In-memory mirror of a layer, kept current with server-sent events"""
+
+import threading
+import warnings
+
+from .client import CamomileNotFound
+from .index import _annotation_id
+
+
+class LayerMirror(object):
+    """In-memory copy of the annotations of a layer
+
+    The mirror is bootstrapped once from the server, then kept up to date
+    by applying `watchLayer` server-sent events (as well as changes made
+    through the same client) incrementally -- so that reading it never
+    costs any request.
+
+    The whole layer is only downloaded again when a gap is detected, i.e.
+    when the server-sent events stream had to reconnect (events might have
+    been missed meanwhile) or when `check` finds that the number of
+    annotations does not match.
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    layer : str
+        Layer ID.
+
+    Example
+    -------
+    >>> mirror = LayerMirror(client, layer)
+    >>> len(mirror)
+    >>> mirror.for_medium(medium)
+    >>> mirror.close()
+    """
+
+    def __init__(self, client, layer):
+        super(LayerMirror, self).__init__()
+
+        self._client = client
+        self.layer = layer
+
+        self._lock = threading.RLock()
+        self._annotations = {}
+
+        # events received while (re)synchronizing are buffered, then
+        # replayed on top of the downloaded snapshot
+        self._syncing = False
+        self._buffer = []
+        self._dirty = False
+
+        # number of full (re)synchronizations
+        self.resyncs = 0
+
+        # subscribe first so that no event is missed during bootstrap
+        self._syncing = True
+        client._observe(self)
+        try:
+            client.watchLayer(layer, self._on_server_event)
+        except Exception:
+            client._unobserve(self)
+            raise
+
+        try:
+            self._resync()
+        except Exception:
+            # do not leave a half-built mirror subscribed
+            try:
+                self.close()
+            except Exception as e:
+                warnings.warn('Could not unwatch layer {layer}: {e}'.format(
+                    layer=layer, e=e))
+            raise
+
+    def __len__(self):
+        return len(self._annotations)
+
+    def __contains__(self, annotation):
+        return _annotation_id(annotation) in self._annotations
+
+    def __iter__(self):
+        with self._lock:
+            annotations = list(self._annotations.values())
+        for annotation in annotations:
+            yield annotation
+
+    def get(self, annotation, default=None):
+        """Get annotation by ID"""
+        return self._annotations.get(annotation, default)
+
+    def for_medium(self, medium):
+        """Get annotations of one medium"""
+        return [a for a in self if a.get('id_medium', None) == medium]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # SYNCHRONIZATION
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def resync(self):
+        """Download the whole layer again"""
+        with self._lock:
+            if self._syncing:
+                # already in progress: do it once more when done
+                self._dirty = True
+                return
+            self._syncing = True
+        self._resync()
+
+    def _resync(self):
+        # caller is expected to have set self._syncing
+        while True:
+
+            with self._lock:
+                self._buffer = []
+                self._dirty = False
+
+            try:
+                annotations = dict(
+                    (a['_id'], a)
+                    for a in self._client.iterAnnotations(self.layer))
+            except Exception:
+                with self._lock:
+                    self._syncing = False
+                    self._buffer = []
+                raise
+
+            with self._lock:
+                if self._dirty:
+                    continue
+                self._annotations = annotations
+                for name, value in self._buffer:
+                    self._apply(name, value)
+                self._buffer = []
+                self._syncing = False
+                self.resyncs += 1
+                return
+
+    def _resync_in_background(self):
+        with self._lock:
+            if self._syncing:
+                self._dirty = True
+                return
+            self._syncing = True
+
+        def resync():
+            try:
+                self._resync()
+            except Exception as e:
+                warnings.warn(
+                    'Could not resynchronize layer {layer}: {e}'.format(
+                        layer=self.layer, e=e))
+
+        thread = threading.Thread(target=resync, name="LayerMirror")
+        thread.daemon = True
+        thread.start()
+
+    def check(self):
+        """Resynchronize if the number of annotations does not match
+
+        Returns
+        -------
+        consistent : boolean
+            False when a resynchronization was needed.
+        """
+        count = self._client.getAnnotations(layer=self.layer,
+                                            returns_count=True)
+        if isinstance(count, dict):
+            count = count['count']
+
+        with self._lock:
+            if self._syncing or count == len(self._annotations):
+                return True
+
+        self.resync()
+        return False
+
+    def close(self):
+        """Stop watching the layer"""
+        self._client._unobserve(self)
+        self._client.unwatchLayer(self.layer,
+                                  callback=self._on_server_event)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # EVENTS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _on_server_event(self, event):
+        self.on_event('layer', self.layer, event)
+
+    def on_event(self, kind, id_, event):
+        """Apply change notified by the client (or server-sent events)
+
+        See `IntervalIndex.on_event`.
+        """
+
+        if kind == 'listener':
+            if event.get('reconnect', False):
+                self._resync_in_background()
+            return
+
+        if kind != 'layer':
+            return
+
+        for name, value in event.items():
+
+            if name not in ('add_annotation', 'update_annotation',
+                            'delete_annotation'):
+                continue
+
+            # events may only carry the annotation ID
+            if name != 'delete_annotation' and not isinstance(value, dict):
+                try:
+                    value = self._client.getAnnotation(value)
+                except CamomileNotFound:
+                    name = 'delete_annotation'
+
+            if isinstance(value, dict):
+                # layer is only implied for updates
+                if value.get('id_layer', id_) != self.layer:
+                    name = 'delete_annotation'
+            elif id_ not in (None, self.layer):
+                continue
+
+            with self._lock:
+                if self._syncing:
+                    self._buffer.append((name, value))
+                else:
+                    self._apply(name, value)
+
+    def _apply(self, name, value):
+        # caller is expected to hold self._lock
+        if name == 'delete_annotation':
+            self._annotations.pop(_annotation_id(value), None)
+        else:
+            self._annotations[value['_id']] = value
+
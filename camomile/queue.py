@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Consumption (and production) of queue elements"""
+
+import collections
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    wait, FIRST_COMPLETED
+
+from .client import CamomileNotFound, RETRIABLE_ERRORS, is_unsent
+from .bulk import retry
+
+
+# returned by QueueWorker._dequeue when queue is empty
+_EMPTY = object()
+
+
+class QueueWorker(object):
+    """Process queue elements concurrently
+
+    Elements are dequeued and passed to `handler`, `max_workers` at a time.
+    Next elements are dequeued (prefetched) while the handler is busy, so
+    that workers never wait for the server.  When the queue is empty, it is
+    polled again after an increasing delay (from `min_delay` to `max_delay`
+    seconds), reset as soon as an element is found.
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    queue : str
+        Queue ID.
+    handler : callable
+        Function of one element.  Must be picklable when `processes` is
+        True.
+    max_workers : int, optional
+        Number of elements processed at the same time.  Defaults to 4.
+    processes : boolean, optional
+        Use a pool of processes rather than threads (for CPU-bound
+        handlers).  Defaults to False.
+    prefetch : int, optional
+        Number of elements dequeued in advance.  Defaults to `max_workers`.
+    min_delay, max_delay : float, optional
+        Delay between polls of an empty queue.  Defaults to 0.1 and 30
+        seconds.
+    on_error : callable, optional
+        Called with (element, exception) when `handler` fails.  Defaults to
+        emitting a warning.
+
+    Example
+    -------
+    >>> worker = QueueWorker(client, queue, process, max_workers=8)
+    >>> worker.start()
+    >>> ...
+    >>> worker.stop()
+    >>> worker.stats
+    """
+
+    def __init__(self, client, queue, handler, max_workers=4,
+                 processes=False, prefetch=None, min_delay=0.1,
+                 max_delay=30., on_error=None):
+        super(QueueWorker, self).__init__()
+
+        self.client = client
+        self.queue = queue
+        self.handler = handler
+        self.max_workers = max_workers
+        self.processes = processes
+        self.prefetch = max_workers if prefetch is None else prefetch
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.on_error = on_error
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._latency = 0.
+        self._max_latency = 0.
+        self._started = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # COUNTERS
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @property
+    def stats(self):
+        """Counters
+
+        'dequeued', 'processed', 'failed' and 'requeued' elements, 'empty'
+        polls and dequeue 'errors', 'throughput' (processed elements per
+        second), 'latency' and 'max latency' (in seconds, from dequeue to
+        end of processing).
+        """
+
+        with self._lock:
+            stats = dict(self._counters)
+            done = self._counters['processed'] + self._counters['failed']
+            latency = self._latency / done if done else 0.
+            max_latency = self._max_latency
+            started = self._started
+
+        for name in ['dequeued', 'processed', 'failed', 'requeued', 'empty',
+                     'errors']:
+            stats.setdefault(name, 0)
+
+        elapsed = time.time() - started if started else 0.
+        stats['throughput'] = stats['processed'] / elapsed if elapsed else 0.
+        stats['latency'] = latency
+        stats['max latency'] = max_latency
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # PROCESSING
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _dequeue(self):
+        try:
+            element = self.client.dequeue(self.queue)
+        except CamomileNotFound:
+            # empty queue
+            element = None
+        except RETRIABLE_ERRORS:
+            self._count('errors')
+            return _EMPTY
+
+        if element is None:
+            self._count('empty')
+            return _EMPTY
+
+        self._count('dequeued')
+        return element
+
+    def _done(self, future, element, dequeued):
+
+        latency = time.time() - dequeued
+        with self._lock:
+            self._latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+        try:
+            future.result()
+        except Exception as e:
+            self._count('failed')
+            if self.on_error is None:
+                warnings.warn('Failed to process {element!r}: {e}'.format(
+                    element=element, e=e))
+            else:
+                self.on_error(element, e)
+        else:
+            self._count('processed')
+
+    def run(self):
+        """Process elements until `stop` is called"""
+
+        self._stopping.clear()
+        with self._lock:
+            self._started = time.time()
+
+        Executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+
+        # dequeued elements, not submitted yet
+        buffer = collections.deque()
+        # future --> (element, dequeue time)
+        pending = {}
+
+        delay = self.min_delay
+        next_poll = 0.
+
+        with Executor(max_workers=self.max_workers) as executor:
+
+            try:
+                while not self._stopping.is_set():
+
+                    # prefetch
+                    while (len(buffer) + len(pending) <
+                           self.max_workers + self.prefetch and
+                           time.time() >= next_poll and
+                           not self._stopping.is_set()):
+                        element = self._dequeue()
+                        if element is _EMPTY:
+                            # back off
+                            next_poll = time.time() + delay
+                            delay = min(2 * delay, self.max_delay)
+                            break
+                        buffer.append((element, time.time()))
+                        delay, next_poll = self.min_delay, 0.
+
+                    while buffer and len(pending) < self.max_workers:
+                        element, dequeued = buffer.popleft()
+                        future = executor.submit(self.handler, element)
+                        pending[future] = (element, dequeued)
+
+                    if not pending:
+                        self._stopping.wait(max(0., next_poll - time.time()))
+                        continue
+
+                    # wait for a handler to complete, or for next poll
+                    timeout = None
+                    if next_poll:
+                        timeout = max(0., next_poll - time.time())
+
+                    done, _ = wait(pending, timeout=timeout,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._done(future, *pending.pop(future))
+
+            finally:
+                # let running handlers finish...
+                wait(pending)
+                for future, (element, dequeued) in pending.items():
+                    self._done(future, element, dequeued)
+
+                # ... and put back prefetched elements
+                if buffer:
+                    elements = [element for element, _ in buffer]
+                    self.client.enqueue(self.queue, elements)
+                    self._count('requeued', len(elements))
+
+    def start(self):
+        """Process elements in a background thread"""
+        self._thread = threading.Thread(target=self.run, name="QueueWorker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop dequeuing, wait for running handlers and requeue prefetched
+        elements"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class QueueProducer(object):
+    """Enqueue elements in batches
+
+    Elements are buffered and sent with one request per batch, as soon as
+    `batch_size` elements are buffered or the oldest buffered element is
+    `max_age` seconds old (whichever comes first).  Remaining elements are
+    sent on `close` (or when leaving the `with` block).
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    queue : str
+        Queue ID.
+    batch_size : int, optional
+        Maximum number of elements per request.  Defaults to 1000.
+    max_age : float, optional
+        Maximum time (in seconds) an element is buffered.  Defaults to 1
+        second.  Set to None to only flush full batches.
+    max_retries : int, optional
+        Number of retries of requests that failed to reach the server
+        (see `camomile.client.is_unsent`).  Defaults to 3.  Requests are not
+        retried after any other error, as the server may already have
+        enqueued their elements.
+    retry_delay : float, optional
+        See `camomile.bulk.retry`.  Defaults to 1 second.
+
+    Example
+    -------
+    >>> with QueueProducer(client, queue) as producer:
+    ...     for element in elements:
+    ...         producer.put(element)
+    """
+
+    def __init__(self, client, queue, batch_size=1000, max_age=1.,
+                 max_retries=3, retry_delay=1.):
+        super(QueueProducer, self).__init__()
+
+        if batch_size < 1:
+            raise ValueError('Batch size must be strictly positive.')
+
+        self.client = client
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_age = max_age
+
+        self._enqueue = retry(client.enqueue, max_retries=max_retries,
+                              retry_on=is_unsent,
+                              retry_delay=retry_delay)
+
+        # buffered elements and time at which the oldest one was buffered
+        self._buffer = []
+        self._oldest = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+        # one flush at a time, so that elements are enqueued in order
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        """Number of buffered elements"""
+        with self._condition:
+            return len(self._buffer)
+
+    @property
+    def stats(self):
+        """Counters
+
+        'put' elements, 'enqueued' elements, 'requests' (successful enqueue
+        requests) and 'failures' (enqueue requests failing after all
+        retries).
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        for name in ['put', 'enqueued', 'requests', 'failures']:
+            stats.setdefault(name, 0)
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def put(self, element):
+        """Buffer one element"""
+        self.extend([element])
+
+    def extend(self, elements):
+        """Buffer several elements"""
+
+        elements = list(elements)
+
+        with self._condition:
+
+            if self._closed:
+                raise ValueError('Producer is closed.')
+
+            if not elements:
+                return
+
+            if not self._buffer:
+                self._oldest = time.time()
+            self._buffer.extend(elements)
+            full = len(self._buffer) >= self.batch_size
+
+            if self.max_age is not None and self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="QueueProducer")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+        self._count('put', len(elements))
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Enqueue all buffered elements
+
+        Raises the last error when a batch could not be enqueued, in which
+        case unsent elements are buffered again (in their original order).
+        """
+
+        with self._flush_lock:
+
+            with self._condition:
+                elements, self._buffer = self._buffer, []
+                self._oldest = None
+
+            for i in range(0, len(elements), self.batch_size):
+                batch = elements[i:i + self.batch_size]
+                try:
+                    self._enqueue(self.queue, batch)
+                except Exception:
+                    self._count('failures')
+                    with self._condition:
+                        self._buffer[:0] = elements[i:]
+                        # try again in `max_age` seconds at the earliest
+                        self._oldest = time.time()
+                    raise
+                self._count('requests')
+                self._count('enqueued', len(batch))
+
+    def _run(self):
+        # flush elements once they get too old
+        while True:
+
+            with self._condition:
+                while not self._closed:
+                    if self._oldest is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._oldest + self.max_age - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+
+            try:
+                self.flush()
+            except Exception as e:
+                warnings.warn(
+                    'Failed to enqueue {n:d} elements: {e}'.format(
+                        n=len(self), e=e))
+
+    def close(self):
+        """Stop buffering and enqueue remaining elements"""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            thread.join()
+
+        self.flush()
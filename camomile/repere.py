@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Import of REPERE annotation files
+
+REPERE files have one annotation per line:
+
+    medium start end type label
+"""
+
+import threading
+import time
+
+from .bulk import chunks, parallel_imap
+from .client import is_unsent
+
+
+def iter_repere(path, types=None):
+    """Parse REPERE file, one line at a time
+
+    Parameters
+    ----------
+    path : str or file
+        Path to REPERE file (or file object).
+    types : iterable, optional
+        Only keep annotations of these types (e.g. 'speaker').
+
+    Returns
+    -------
+    annotations : iterator
+        Iterator over (medium, start, end, type, label) tuples, where
+        `medium` is the medium name.
+    """
+
+    if types is not None:
+        types = set(types)
+
+    f = path if hasattr(path, 'read') else open(path, 'r')
+
+    try:
+        for line in f:
+
+            # label may contain spaces
+            tokens = line.split(None, 4)
+            if not tokens:
+                continue
+
+            if len(tokens) < 5:
+                raise ValueError(
+                    'Invalid REPERE line: "{line}".'.format(line=line.strip()))
+
+            medium, start, end, type_, label = tokens
+            if types is not None and type_ not in types:
+                continue
+
+            yield medium, float(start), float(end), type_, label.strip()
+
+    finally:
+        if f is not path:
+            f.close()
+
+
+class RepereImporter(object):
+    """Fast import of REPERE files into a corpus
+
+    Media are looked up by name (and created in bulk when missing), and
+    annotations are uploaded in chunks, several chunks at a time, while the
+    file is being parsed.
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    corpus : str
+        Corpus ID.
+    url : str, optional
+        Template of media URL, e.g. 'REPERE/phase2/test/{name}'.
+        Defaults to the medium name.
+    chunk_size : int, optional
+        Number of annotations per request.  Defaults to 5000.
+    max_workers : int, optional
+        Maximum number of concurrent requests.  Defaults to 4.
+    max_retries : int, optional
+        Number of times a chunk is sent again when it could not reach the
+        server.  Defaults to 3.  See `Camomile.createAnnotations`.
+    progress : callable, optional
+        Called after each uploaded chunk with a dictionary with
+        'annotations' (uploaded so far), 'elapsed' (seconds) and
+        'throughput' (annotations per second) keys.
+
+    Example
+    -------
+    >>> importer = RepereImporter(client, corpus, url='REPERE/{name}')
+    >>> importer.import_media(name.strip() for name in open('media.lst'))
+    >>> layer = importer.import_layer('reference.repere', 'reference')
+    """
+
+    def __init__(self, client, corpus, url=None, chunk_size=5000,
+                 max_workers=4, max_retries=3, progress=None):
+        super(RepereImporter, self).__init__()
+
+        self.client = client
+        self.corpus = corpus
+        self.url = url
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.progress = progress
+
+        # medium name --> medium ID
+        self._media = None
+        self._lock = threading.Lock()
+
+    def _medium(self, name):
+        url = name if self.url is None else self.url.format(name=name)
+        return {'name': name, 'url': url}
+
+    def import_media(self, names):
+        """Get medium IDs, creating missing media in one single request
+
+        Parameters
+        ----------
+        names : iterable
+            Medium names.
+
+        Returns
+        -------
+        media : dict
+            Medium name --> medium ID dictionary.
+        """
+
+        with self._lock:
+
+            if self._media is None:
+                self._media = dict(
+                    (medium.name, medium._id)
+                    for medium in self.client.getMedia(corpus=self.corpus))
+
+            missing = []
+            for name in names:
+                if name not in self._media and name not in missing:
+                    missing.append(name)
+
+            if missing:
+                created = self.client.createMedia(
+                    self.corpus, [self._medium(name) for name in missing],
+                    returns_id=True)
+                self._media.update(zip(missing, created))
+
+            return dict(self._media)
+
+    def _annotations(self, path, types):
+        # resolve medium names one chunk at a time
+        for chunk in chunks(iter_repere(path, types=types), self.chunk_size):
+            media = self.import_media(medium for medium, _, _, _, _ in chunk)
+            yield [{'id_medium': media[medium],
+                    'fragment': {'start': start, 'end': end},
+                    'data': label}
+                   for medium, start, end, _, label in chunk]
+
+    def import_layer(self, path, name, description=None, types=None):
+        """Create layer from REPERE file
+
+        Parameters
+        ----------
+        path : str or file
+            Path to REPERE file (or file object).
+        name : str
+            Layer name.
+        description : object, optional
+            Layer description.
+        types : iterable, optional
+            Only import annotations of these types (e.g. 'speaker').
+
+        Returns
+        -------
+        layer : str
+            New layer ID.
+        """
+
+        layer = self.client.createLayer(
+            self.corpus, name, description=description,
+            fragment_type='segment', data_type='label', returns_id=True)
+
+        post = lambda chunk: self.client.createAnnotations(
+            layer, chunk, returns_id=True)
+
+        t0 = time.time()
+        done = 0
+        for created in parallel_imap(post, self._annotations(path, types),
+                                     max_workers=self.max_workers,
+                                     max_retries=self.max_retries,
+                                     retry_on=is_unsent):
+            done += len(created)
+            if self.progress is not None:
+                elapsed = time.time() - t0
+                self.progress({'annotations': done, 'elapsed': elapsed,
+                               'throughput': done / max(elapsed, 1e-6)})
+
+        return layer
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Local name to ID resolution of corpora, media and layers"""
+
+import threading
+
+
+class NameResolver(object):
+    """In-memory name to ID index of corpora, media and layers
+
+    Media and layers of a corpus are loaded at once, the first time one of
+    them is looked up.  Following lookups are answered locally.  Unknown
+    names are looked up on the server (in case they were added in the
+    meantime).
+
+    The index is kept up to date with media and layers created, renamed or
+    deleted through the same client and, when `watch` is True, by anyone
+    else (through server-sent `add_medium` and `add_layer` events).
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    watch : boolean, optional
+        Watch loaded corpora for new media and layers.  Defaults to False.
+
+    Example
+    -------
+    >>> resolver = NameResolver(client)
+    >>> corpus = resolver.corpus('REPERE')
+    >>> medium = resolver.medium(corpus, 'BFMTV_BFMStory_2012-07-24_175800')
+    >>> layer = resolver.layer(corpus, 'reference')
+    """
+
+    def __init__(self, client, watch=False):
+        super(NameResolver, self).__init__()
+
+        self._client = client
+        self.watch = watch
+
+        self._lock = threading.RLock()
+
+        # name --> ID
+        self._corpora = None
+        # corpus ID --> {name --> ID}
+        self._media = {}
+        self._layers = {}
+        # ID --> (index, name)
+        self._names = {}
+
+        # corpus ID --> server-sent events callback
+        self._callbacks = {}
+
+        client._observe(self)
+
+    def _add(self, index, resource):
+        name, id_ = resource['name'], resource['_id']
+        with self._lock:
+            # first one wins when several resources have the same name
+            index.setdefault(name, id_)
+            self._names[id_] = (index, name)
+
+    def _remove(self, id_):
+        with self._lock:
+            index, name = self._names.pop(id_, (None, None))
+            if index is not None and index.get(name, None) == id_:
+                del index[name]
+
+    def _index(self, indexes, corpus):
+        """Get (and load if needed) media or layers index of corpus"""
+
+        with self._lock:
+            index = indexes.get(corpus, None)
+            if index is not None:
+                return index
+
+        if indexes is self._media:
+            resources = self._client.getMedia(corpus=corpus)
+        else:
+            resources = self._client.getLayers(corpus=corpus)
+
+        with self._lock:
+            index = {}
+            for resource in resources:
+                self._add(index, resource)
+            indexes[corpus] = index
+
+        if self.watch:
+            self._watch(corpus)
+
+        return index
+
+    def _watch(self, corpus):
+        with self._lock:
+            if corpus in self._callbacks:
+                return
+
+            def callback(event):
+                self.on_event('corpus', corpus, event)
+
+            self._callbacks[corpus] = callback
+
+        self._client.watchCorpus(corpus, callback)
+
+    def _lookup(self, indexes, corpus, name):
+
+        index = self._index(indexes, corpus)
+        id_ = index.get(name, None)
+        if id_ is not None:
+            return id_
+
+        # may have been added in the meantime
+        if indexes is self._media:
+            resources = self._client.getMedia(corpus=corpus, name=name)
+        else:
+            resources = self._client.getLayers(corpus=corpus, name=name)
+
+        for resource in resources:
+            self._add(index, resource)
+
+        id_ = index.get(name, None)
+        if id_ is None:
+            raise KeyError(name)
+        return id_
+
+    def corpus(self, name):
+        """Get corpus ID from its name"""
+
+        with self._lock:
+            if self._corpora is None:
+                corpora = {}
+                for corpus in self._client.getCorpora():
+                    self._add(corpora, corpus)
+                self._corpora = corpora
+            # a reconnection may reset the index meanwhile (see `on_event`)
+            corpora = self._corpora
+            id_ = corpora.get(name, None)
+
+        if id_ is not None:
+            return id_
+
+        for corpus in self._client.getCorpora(name=name):
+            self._add(corpora, corpus)
+
+        id_ = corpora.get(name, None)
+        if id_ is None:
+            raise KeyError(name)
+        return id_
+
+    def medium(self, corpus, name):
+        """Get medium ID from its name
+
+        Parameters
+        ----------
+        corpus : str
+            Corpus ID.
+        name : str
+            Medium name.
+        """
+        return self._lookup(self._media, corpus, name)
+
+    def layer(self, corpus, name):
+        """Get layer ID from its name
+
+        Parameters
+        ----------
+        corpus : str
+            Corpus ID.
+        name : str
+            Layer name.
+        """
+        return self._lookup(self._layers, corpus, name)
+
+    def media(self, corpus):
+        """Get {name: ID} dictionary of all media of corpus"""
+        with self._lock:
+            return dict(self._index(self._media, corpus))
+
+    def layers(self, corpus):
+        """Get {name: ID} dictionary of all layers of corpus"""
+        with self._lock:
+            return dict(self._index(self._layers, corpus))
+
+    def close(self):
+        """Stop watching corpora"""
+        with self._lock:
+            callbacks = list(self._callbacks.items())
+            self._callbacks = {}
+        for corpus, callback in callbacks:
+            self._client.unwatchCorpus(corpus, callback=callback)
+
+    def on_event(self, kind, id_, event):
+        """Apply change notified by the client (or server-sent events)
+
+        See `IntervalIndex.on_event`.
+        """
+
+        if kind == 'listener':
+            # events may have been missed: reload on next lookup
+            if event.get('reconnect', False):
+                with self._lock:
+                    # cleared in place as concurrent lookups rely on
+                    # their identity (see `_lookup`)
+                    self._media.clear()
+                    self._layers.clear()
+                    self._names.clear()
+                    self._corpora = None
+            return
+
+        if kind in ('medium', 'layer'):
+            # renamed resource will be looked up again
+            if 'name' in event.get('update', []):
+                self._remove(id_)
+            return
+
+        if kind != 'corpus':
+            return
+
+        for name, value in event.items():
+
+            if name in ('delete_medium', 'delete_layer'):
+                self._remove(value['_id'] if isinstance(value, dict)
+                             else value)
+                continue
+
+            if name == 'add_medium':
+                indexes, get = self._media, self._client.getMedium
+            elif name == 'add_layer':
+                indexes, get = self._layers, self._client.getLayer
+            else:
+                continue
+
+            # not loaded yet: will be loaded on first lookup anyway
+            if id_ is not None and id_ not in indexes:
+                continue
+
+            # events may only carry the resource ID
+            if not isinstance(value, dict):
+                value = get(value)
+
+            index = indexes.get(value.get('id_corpus', id_), None)
+            if index is not None:
+                self._add(index, value)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Comparison of segment layers (reference vs. hypothesis)"""
+
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .bulk import parallel_imap_unordered
+from .client import RETRIABLE_ERRORS
+from .columnar import AnnotationArray
+
+
+METRICS = ['total', 'correct', 'confusion', 'missed', 'false alarm']
+
+
+def _key(label):
+    # dictionaries and lists are not hashable
+    try:
+        hash(label)
+    except TypeError:
+        return json.dumps(label, sort_keys=True)
+    return label
+
+
+def _active(boundaries, start, end, label, n_labels):
+    """Number of active segments per elementary interval and per label"""
+
+    counts = np.zeros((len(boundaries), n_labels))
+    np.add.at(counts, (np.searchsorted(boundaries, start), label), 1)
+    np.add.at(counts, (np.searchsorted(boundaries, end), label), -1)
+    return np.cumsum(counts, axis=0)[:-1]
+
+
+def sweep(reference, hypothesis, n_labels):
+    """Compare two sets of segments of one medium
+
+    Boundaries of all segments split the timeline into elementary
+    intervals, over which the number of active reference and hypothesis
+    segments are computed at once, for all labels (with cumulative sums).
+
+    Parameters
+    ----------
+    reference, hypothesis : (start, end, label) tuples
+        Segments start times, end times and label codes (arrays).
+    n_labels : int
+        Number of labels (i.e. label codes are in [0, n_labels[).
+
+    Returns
+    -------
+    durations : dict
+        Durations per label, as (n_labels, ) arrays, with 'reference',
+        'hypothesis', 'correct', 'confusion', 'missed' and 'false alarm'
+        keys.  Confusion and missed durations are attributed to reference
+        labels, false alarm durations to hypothesis labels.
+    """
+
+    r_start, r_end, r_label = reference
+    h_start, h_end, h_label = hypothesis
+
+    boundaries = np.unique(np.concatenate([r_start, r_end, h_start, h_end]))
+    duration = np.diff(boundaries)[:, np.newaxis]
+
+    R = _active(boundaries, r_start, r_end, r_label, n_labels)
+    H = _active(boundaries, h_start, h_end, h_label, n_labels)
+
+    # same label on both sides
+    C = np.minimum(R, H)
+
+    n_ref, n_hyp, n_correct = R.sum(axis=1), H.sum(axis=1), C.sum(axis=1)
+    n_min = np.minimum(n_ref, n_hyp)
+
+    # unmatched reference (resp. hypothesis) segments are either confused
+    # or missed (resp. false alarm), shared among labels pro rata
+    unmatched_ref = R - C
+    unmatched_hyp = H - C
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confusion = np.nan_to_num((n_min - n_correct) / (n_ref - n_correct))
+        missed = np.nan_to_num((n_ref - n_min) / (n_ref - n_correct))
+        false_alarm = np.nan_to_num((n_hyp - n_min) / (n_hyp - n_correct))
+
+    return {
+        'reference': (duration * R).sum(axis=0),
+        'hypothesis': (duration * H).sum(axis=0),
+        'correct': (duration * C).sum(axis=0),
+        'confusion': (duration * unmatched_ref *
+                      confusion[:, np.newaxis]).sum(axis=0),
+        'missed': (duration * unmatched_ref *
+                   missed[:, np.newaxis]).sum(axis=0),
+        'false alarm': (duration * unmatched_hyp *
+                        false_alarm[:, np.newaxis]).sum(axis=0),
+    }
+
+
+def _groups(annotations, media):
+    """Indices of annotations of each medium (in one single sort)"""
+
+    codes = np.array([media[m] for m in annotations.media],
+                     dtype=np.int64)[annotations.medium]
+    order = np.argsort(codes, kind='mergesort')
+    groups = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+    return dict((codes[group[0]], group) for group in groups if len(group))
+
+
+def _totals(durations):
+    totals = {'total': float(durations['reference'].sum())}
+    for metric in METRICS[1:]:
+        totals[metric] = float(durations[metric].sum())
+    errors = totals['confusion'] + totals['missed'] + totals['false alarm']
+    totals['error rate'] = (errors / totals['total'] if totals['total'] > 0
+                            else float(errors > 0))
+    return totals
+
+
+def score(reference, hypothesis):
+    """Compare reference and hypothesis segment annotations
+
+    Labels are compared by value: segments overlapping in time with the
+    same label are correct, with different labels are confusions.  Extra
+    reference (resp. hypothesis) segments are missed (resp. false alarms).
+
+    Parameters
+    ----------
+    reference, hypothesis : AnnotationArray
+        Reference and hypothesis annotations.
+
+    Returns
+    -------
+    scores : dict
+        'total' (reference duration), 'correct', 'confusion', 'missed',
+        'false alarm' durations and 'error rate' (i.e. confusion, missed
+        and false alarm durations over total duration), with details per
+        medium (in 'media' dictionary) and per label (in 'labels'
+        dictionary, with additional 'reference' and 'hypothesis'
+        durations).
+    """
+
+    # labels codes shared by reference and hypothesis
+    labels = {}
+    for label in reference.labels + hypothesis.labels:
+        labels.setdefault(_key(label), (len(labels), label))
+    r_codes = np.array([labels[_key(l)][0] for l in reference.labels],
+                       dtype=np.int64)
+    h_codes = np.array([labels[_key(l)][0] for l in hypothesis.labels],
+                       dtype=np.int64)
+
+    media = {}
+    for medium in reference.media + hypothesis.media:
+        media.setdefault(medium, len(media))
+    r_groups = _groups(reference, media)
+    h_groups = _groups(hypothesis, media)
+    empty = np.zeros((0, ), dtype=np.int64)
+
+    per_label = dict((name, np.zeros(len(labels)))
+                     for name in ['reference', 'hypothesis'] + METRICS[1:])
+    per_medium = {}
+
+    for medium, code in media.items():
+        r = r_groups.get(code, empty)
+        h = h_groups.get(code, empty)
+
+        # only consider labels of this medium
+        local, inverse = np.unique(
+            np.concatenate([r_codes[reference.label[r]],
+                            h_codes[hypothesis.label[h]]]),
+            return_inverse=True)
+        inverse = inverse.reshape(-1)
+        durations = sweep(
+            (reference.start[r], reference.end[r], inverse[:len(r)]),
+            (hypothesis.start[h], hypothesis.end[h], inverse[len(r):]),
+            len(local))
+
+        per_medium[medium] = _totals(durations)
+        for name, values in durations.items():
+            np.add.at(per_label[name], local, values)
+
+    scores = _totals(per_label)
+    scores['media'] = per_medium
+    scores['labels'] = {}
+    for code, label in labels.values():
+        scores['labels'][_key(label)] = dict(
+            (name, float(values[code])) for name, values in per_label.items())
+
+    return scores
+
+
+def score_layers(client, reference, hypothesis, media=None, max_workers=8,
+                max_retries=3):
+    """Compare reference and hypothesis layers
+
+    Both layers are downloaded concurrently (with one request per layer
+    and medium, all sharing the same `max_workers` requests at a time),
+    directly into columnar arrays.
+
+    Parameters
+    ----------
+    client : Camomile
+        Logged in client.
+    reference, hypothesis : str
+        Reference and hypothesis layer IDs.
+    media : iterable, optional
+        Only compare annotations of these media.  Defaults to all media of
+        the reference layer's corpus.
+    max_workers, max_retries : int, optional
+        See `Camomile.iterAnnotationsByMedium`.
+
+    Returns
+    -------
+    scores : dict
+        See `score`.
+
+    Example
+    -------
+    >>> scores = score_layers(client, reference, hypothesis)
+    >>> scores['error rate']
+    """
+
+    if media is None:
+        corpus = client.getLayer(reference).id_corpus
+        media = client.getMedia(corpus=corpus, returns_id=True)
+
+    media = list(media)
+    layers = (reference, hypothesis)
+
+    get = lambda item: client.getAnnotations(layer=item[0], medium=item[1],
+                                             returns_array=True)
+
+    arrays = dict(parallel_imap_unordered(
+        get, [(layer, medium) for layer in layers for medium in media],
+        max_workers=max_workers, max_retries=max_retries,
+        retry_on=RETRIABLE_ERRORS))
+
+    return score(*[AnnotationArray.concatenate(arrays[layer, medium]
+                                               for medium in media)
+                   for layer in layers])
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# AUTHORS
+# Hervé BREDIN (http://herve.niderb.fr/)
+
+"""Incremental parsing (and encoding) of streamed HTTP bodies"""
+
+import base64
+import codecs
+import json
+import os
+
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]}:'
+
+
+def iter_text(response, chunk_size=65536):
+    """Iterate over (UTF-8 decoded) text chunks of a streamed response"""
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+class _Reader(object):
+    """Buffered reader over text chunks"""
+
+    def __init__(self, chunks):
+        super(_Reader, self).__init__()
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+
+    def fill(self):
+        """Append next chunk to buffer (returns False when there is none)"""
+
+        if self.exhausted:
+            return False
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            return False
+
+        # forget about what has already been consumed
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Return next non-whitespace character (None at end of stream)"""
+
+        while True:
+            while (self.position < len(self.buffer) and
+                   self.buffer[self.position] in WHITESPACE):
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+
+            if not self.fill():
+                return None
+
+    def decode(self, decoder):
+        """Decode next JSON value"""
+
+        self.peek()
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                end = None
+
+            # only accept the value when followed by a delimiter, as it might
+            # be incomplete otherwise (e.g. number split over two chunks)
+            complete = (end is not None and end < len(self.buffer) and
+                        self.buffer[end] in DELIMITERS)
+
+            if complete or not self.fill():
+                if end is None:
+                    raise ValueError('Invalid JSON value.')
+                self.position = end
+                return value
+
+
+def iter_json_array(chunks):
+    """Incrementally parse a JSON array, one item at a time
+
+    Memory usage is bounded by the size of one item (plus one chunk), not
+    by the size of the whole array.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Text chunks whose concatenation is a JSON array.
+
+    Returns
+    -------
+    items : iterator
+        Iterator over JSON-decoded items of the array.
+    """
+
+    decoder = json.JSONDecoder()
+    reader = _Reader(chunks)
+
+    if reader.peek() != '[':
+        raise ValueError('Expected JSON array.')
+    reader.position += 1
+
+    if reader.peek() == ']':
+        return
+
+    while True:
+
+        yield reader.decode(decoder)
+
+        character = reader.peek()
+        if character == ']':
+            return
+        if character != ',':
+            raise ValueError('Expected "," or "]".')
+        reader.position += 1
+
+
+def iter_metadata_file(metadata_path, file_path, chunk_size=3 << 18):
+    """Iterate over chunks of the JSON body of a metadata file upload
+
+    The file is read and base64-encoded one chunk at a time, so that memory
+    usage does not depend on the file size.
+
+    Parameters
+    ----------
+    metadata_path : str
+        Dotted metadata path (e.g. 'models.speaker').
+    file_path : str
+        Path to file.
+    chunk_size : int, optional
+        Number of bytes read at once.  Must be a multiple of 3 so that
+        concatenated base64 chunks are valid base64.  Defaults to 768kB.
+
+    Returns
+    -------
+    chunks : iterator
+        Iterator over UTF-8 encoded chunks of
+        {"path": {"to": {"type": "file", "filename": ..., "data": ...}}}
+    """
+
+    if chunk_size % 3:
+        raise ValueError('Chunk size must be a multiple of 3.')
+
+    tokens = metadata_path.split('.')
+
+    head = ''.join('{{{key}:'.format(key=json.dumps(token))
+                   for token in tokens)
+    head += '{{"type":"file","filename":{filename},"data":"'.format(
+        filename=json.dumps(os.path.basename(file_path)))
+    yield head.encode('utf-8')
+
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+
+    yield ('"}' + '}' * len(tokens)).encode('utf-8')
+
+
+def _write_base64_string(reader, f):
+    """Decode base64 JSON string (opening quote already consumed) to `f`"""
+
+    pending = ''
+    while True:
+
+        end = reader.buffer.find('"', reader.position)
+        stop = len(reader.buffer) if end < 0 else end
+        segment = reader.buffer[reader.position:stop]
+
+        # keep escape sequence split over two chunks for next round
+        keep = 0
+        if end < 0:
+            while keep < len(segment) and segment[-1 - keep] == '\\':
+                keep += 1
+            keep %= 2
+        segment = segment[:len(segment) - keep]
+
+        # JSON encoders may escape "/" and wrap base64 lines
+        if '\\' in segment:
+            segment = segment.replace('\\/', '/').replace(
+                '\\n', '').replace('\\r', '')
+
+        data = pending + segment
+        n = len(data) // 4 * 4
+        if n:
+            f.write(base64.b64decode(data[:n]))
+        pending = data[n:]
+
+        if end >= 0:
+            reader.position = end + 1
+            if pending.strip():
+                raise ValueError('Invalid base64 data.')
+            return
+
+        reader.position = stop - keep
+        if not reader.fill():
+            raise ValueError('Unterminated JSON string.')
+
+
+def write_metadata_file(chunks, f):
+    """Incrementally decode file metadata, writing file content to `f`
+
+    The base64-encoded content is decoded one chunk at a time, so that
+    memory usage does not depend on the file size.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Text chunks whose concatenation is a file metadata JSON object, i.e.
+        {"type": "file", "filename": ..., "data": ...}
+    f : file
+        Binary file object.
+
+    Returns
+    -------
+    metadata : dict
+        File metadata, except for its content (e.g. 'filename').
+    """
+
+    decoder = json.JSONDecoder()
+    reader = _Reader(chunks)
+
+    if reader.peek() != '{':
+        raise ValueError('Expected JSON object.')
+    reader.position += 1
+
+    metadata = {}
+    if reader.peek() == '}':
+        return metadata
+
+    while True:
+
+        key = reader.decode(decoder)
+        if reader.peek() != ':':
+            raise ValueError('Expected ":".')
+        reader.position += 1
+
+        if key == 'data' and reader.peek() == '"':
+            reader.position += 1
+            _write_base64_string(reader, f)
+        else:
+            metadata[key] = reader.decode(decoder)
+
+        character = reader.peek()
+        if character == '}':
+            return metadata
+        if character != ',':
+            raise ValueError('Expected "," or "}".')
+        reader.position += 1
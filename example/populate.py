@@ -34,6 +34,7 @@ URL = 'REPERE/phase2/test/{name}'
 # =============================================================================
 
 from camomile import Camomile
+from camomile.repere import RepereImporter
 
 client = Camomile(SERVER)
 
@@ -49,69 +50,20 @@ client.login(ADMIN, ADMIN_PASSWORD)
 # create new corpus
 corpus = client.createCorpus('REPERE', returns_id=True)
 
-# add media to corpus and keep track of their IDs
-mediaID = {}
-with open('media.lst', 'r') as f:
-    for medium in f:
-
-        # remove trailing "\n"
-        name = medium.strip()
-
-        # create medium
-        mediaID[name] = client.createMedium(
-            corpus, name, url=URL.format(name=name), returns_id=True)
-
-
-# parse sample annotation files
-def parse(path, mediaID):
-
-    annotations = []
-
-    with open(path, 'r') as f:
 
-        for line in f:
+def progress(stats):
+    print('{annotations:d} annotations ({throughput:.0f}/s)'.format(**stats))
 
-            # remove trailing "\n" and split on spaces
-            tokens = line.strip().split()
-
-            # get medium ID
-            mediumName = tokens[0]
-            id_medium = mediaID[mediumName]
-
-            # get fragment start and end times
-            startTime = float(tokens[1])
-            endTime = float(tokens[2])
-
-            # get data
-            label = tokens[4]
-
-            annotation = {'fragment': {'start': startTime, 'end': endTime},
-                          'data': label,
-                          'id_medium': id_medium}
-
-            # append annotations to the list
-            annotations.append(annotation)
-
-    return annotations
+importer = RepereImporter(client, corpus, url=URL, progress=progress)
 
+# add media to corpus (in one single request)
+with open('media.lst', 'r') as f:
+    importer.import_media(line.strip() for line in f if line.strip())
 
 # create reference layer
-annotations = parse('reference.repere', mediaID)
-reference = client.createLayer(
-    corpus, 'reference',
-    fragment_type='segment',
-    data_type='label',
-    annotations=annotations,
-    returns_id=True)
+reference = importer.import_layer('reference.repere', 'reference')
 
 # create hypothesis layers
 for i in [2]:
     path = 'hypothesis{i}.repere'.format(i=i)
-    annotations = parse(path, mediaID)
-    hypothesis = client.createLayer(
-        corpus,
-        'hypothesis {i}'.format(i=i),
-        fragment_type='segment',
-        data_type='label',
-        annotations=annotations,
-        returns_id=True)
+    hypothesis = importer.import_layer(path, 'hypothesis {i}'.format(i=i))
@@ -48,8 +48,14 @@ setup(
     packages=find_packages(),
     install_requires=[
         'tortilla >= 0.4.2',
-        'sseclient >= 0.0.11'
+        'sseclient >= 0.0.12',
+        'futures; python_version < "3.0"',
     ],
+    extras_require={
+        'async': ['aiohttp >= 3.3'],
+        'numpy': ['numpy'],
+        'arrow': ['numpy', 'pyarrow'],
+    },
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Science/Research",
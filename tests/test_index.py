@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import random
+
+import pytest
+
+from camomile.index import IntervalIndex
+
+
+def _segments(rng, n, offset=0):
+    segments = []
+    for i in range(n):
+        # coarse times so that boundaries often coincide
+        start = rng.randint(0, 400) / 2.
+        # mostly short segments, and a few long ones
+        duration = rng.choice([0.5, 1., 2.5, 10., rng.randint(0, 300)])
+        segments.append({'_id': str(offset + i), 'id_medium': 'M',
+                         'fragment': {'start': start, 'end': start + duration},
+                         'data': None})
+    return segments
+
+
+def _ids(annotations):
+    return [a['_id'] for a in annotations]
+
+
+def _sorted(annotations):
+    return sorted(annotations,
+                  key=lambda a: (a['fragment']['start'], a['_id']))
+
+
+def _distance(annotation, t):
+    start, end = annotation['fragment']['start'], annotation['fragment']['end']
+    if start <= t < end:
+        return 0.
+    return min(abs(start - t), abs(end - t))
+
+
+def _check(index, annotations, rng):
+    assert len(index) == len(annotations)
+    assert _ids(index) == _ids(_sorted(annotations))
+
+    for _ in range(200):
+        t = rng.randint(-20, 820) / 4.
+        u = t + rng.choice([0., 0.25, 3., 50., 500.])
+
+        expected = [a for a in annotations
+                    if a['fragment']['start'] < u and a['fragment']['end'] > t]
+        assert _ids(index.overlapping(t, u)) == _ids(_sorted(expected))
+
+        expected = [a for a in annotations
+                    if a['fragment']['start'] <= t < a['fragment']['end']]
+        assert _ids(index.at(t)) == _ids(_sorted(expected))
+
+        expected = [a for a in annotations
+                    if a['fragment']['start'] >= t and
+                    a['fragment']['end'] <= u]
+        assert _ids(index.contained(t, u)) == _ids(_sorted(expected))
+
+        nearest = index.nearest(t)
+        if not annotations:
+            assert nearest is None
+            continue
+        assert _distance(nearest, t) == min(_distance(a, t)
+                                            for a in annotations)
+        # active annotations come first, the one starting first
+        active = index.at(t)
+        if active:
+            assert nearest == active[0]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_queries_match_brute_force(seed):
+    rng = random.Random(seed)
+    annotations = _segments(rng, 300)
+    index = IntervalIndex(annotations)
+    _check(index, annotations, rng)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_updates_match_brute_force(seed):
+    rng = random.Random(seed)
+    annotations = _segments(rng, 200)
+    index = IntervalIndex(annotations[:100])
+
+    for annotation in annotations[100:]:
+        index.add(annotation)
+
+    removed = rng.sample(annotations, 80)
+    for annotation in removed:
+        assert index.remove(annotation['_id'])
+    assert not index.remove(removed[0])
+    annotations = [a for a in annotations if a not in removed]
+
+    # replacing an annotation moves it
+    moved = dict(annotations[0], fragment={'start': 1000., 'end': 1001.})
+    index.add(moved)
+    annotations[0] = moved
+
+    _check(index, annotations, rng)
+
+
+def test_empty():
+    index = IntervalIndex()
+    assert index.overlapping(0., 10.) == []
+    assert index.nearest(0.) is None
+
+
+def test_on_event():
+    index = IntervalIndex(layer='L', medium='M')
+    annotation = {'_id': 'a', 'id_medium': 'M',
+                  'fragment': {'start': 0., 'end': 1.}}
+
+    index.on_event('layer', 'L', {'add_annotation': annotation})
+    index.on_event('layer', 'other', {'delete_annotation': 'a'})
+    assert 'a' in index
+
+    moved = dict(annotation, id_medium='other')
+    index.on_event('layer', 'L', {'update_annotation': moved})
+    assert 'a' not in index
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from camomile.columnar import AnnotationArray
+from camomile.scoring import score
+
+
+def _array(segments):
+    return AnnotationArray.from_annotations(
+        {'id_medium': medium, 'fragment': {'start': start, 'end': end},
+         'data': label}
+        for medium, start, end, label in segments)
+
+
+REFERENCE = [
+    ('m1', 0., 10., 'A'),
+    ('m1', 10., 20., 'B'),
+    ('m2', 0., 4., 'A'),
+    ('m2', 10., 12., 'A'),
+    ('m2', 10., 12., 'B'),
+]
+
+HYPOTHESIS = [
+    ('m1', 0., 5., 'A'),
+    ('m1', 5., 15., 'B'),
+    ('m1', 15., 25., 'C'),
+    ('m2', 10., 12., 'A'),
+]
+
+
+def _check(scores, expected):
+    for name, value in expected.items():
+        assert scores[name] == pytest.approx(value), name
+
+
+def test_score():
+    scores = score(_array(REFERENCE), _array(HYPOTHESIS))
+
+    # m1: [0, 5] correct, [5, 10] A confused with B, [10, 15] correct,
+    # [15, 20] B confused with C, [20, 25] false alarm
+    _check(scores['media']['m1'],
+           {'total': 20., 'correct': 10., 'confusion': 10., 'missed': 0.,
+            'false alarm': 5., 'error rate': 15. / 20.})
+
+    # m2: [0, 4] missed, [10, 12] A correct but overlapping B missed
+    _check(scores['media']['m2'],
+           {'total': 8., 'correct': 2., 'confusion': 0., 'missed': 6.,
+            'false alarm': 0., 'error rate': 6. / 8.})
+
+    _check(scores,
+           {'total': 28., 'correct': 12., 'confusion': 10., 'missed': 6.,
+            'false alarm': 5., 'error rate': 21. / 28.})
+
+    _check(scores['labels']['A'],
+           {'reference': 16., 'hypothesis': 7., 'correct': 7.,
+            'confusion': 5., 'missed': 4., 'false alarm': 0.})
+    _check(scores['labels']['B'],
+           {'reference': 12., 'hypothesis': 10., 'correct': 5.,
+            'confusion': 5., 'missed': 2., 'false alarm': 0.})
+    _check(scores['labels']['C'],
+           {'reference': 0., 'hypothesis': 10., 'correct': 0.,
+            'confusion': 0., 'missed': 0., 'false alarm': 5.})
+
+
+def test_score_identical():
+    reference = _array(REFERENCE)
+    scores = score(reference, reference)
+    _check(scores, {'total': 28., 'correct': 28., 'error rate': 0.})
+
+
+def test_score_empty_reference():
+    scores = score(_array([]), _array(HYPOTHESIS))
+    _check(scores, {'total': 0., 'false alarm': 27., 'error rate': 1.})
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014-2016 CNRS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+import base64
+import io
+import json
+import random
+
+import pytest
+
+from camomile.stream import iter_json_array, iter_metadata_file, \
+    write_metadata_file
+
+
+ITEMS = [
+    {'_id': '1', 'fragment': {'start': 0.5, 'end': 1e-3}, 'data': 'A'},
+    'quote " backslash \\ slash / delimiters , ] } : [ {',
+    u'unicode é中 \U0001f600 and  ',
+    [[], {}, [[1, [2, [3]]]], {'a': {'b': {'c': None}}}],
+    -12, 3.25, 1.5e+300, True, False, None, '',
+]
+
+
+def _split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_json_array(size, indent):
+    text = json.dumps(ITEMS, indent=indent)
+    assert list(iter_json_array(_split(text, size))) == ITEMS
+
+
+def test_iter_json_array_numbers_split_over_chunks():
+    # a number must not be decoded before all of its digits are read
+    text = '[12345, 678.9e1]'
+    assert list(iter_json_array(_split(text, 1))) == [12345, 6789.]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '\n[\n]\n'])
+def test_iter_json_array_empty(text):
+    assert list(iter_json_array(_split(text, 1))) == []
+
+
+@pytest.mark.parametrize('text', ['{}', '[1 2]', '[1,', '["a'])
+def test_iter_json_array_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(_split(text, 1)))
+
+
+def _upload(tmpdir, content, chunk_size):
+    path = tmpdir.join('model.bin')
+    path.write_binary(content)
+    chunks = iter_metadata_file('models.speaker', str(path),
+                                chunk_size=chunk_size)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def _download(metadata, size):
+    f = io.BytesIO()
+    result = write_metadata_file(_split(json.dumps(metadata), size), f)
+    return result, f.getvalue()
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 3, 4, 5, 1000, 3 << 10])
+@pytest.mark.parametrize('size', [1, 5, 1 << 16])
+def test_metadata_file_round_trip(tmpdir, length, size):
+    content = bytes(bytearray(random.Random(length).getrandbits(8)
+                              for _ in range(length)))
+
+    body = _upload(tmpdir, content, 3 * 7)
+    metadata = body['models']['speaker']
+    assert metadata['type'] == 'file'
+    assert metadata['filename'] == 'model.bin'
+    assert base64.b64decode(metadata['data']) == content
+
+    result, downloaded = _download(metadata, size)
+    assert downloaded == content
+    assert result == {'type': 'file', 'filename': 'model.bin'}
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 1 << 16])
+def test_write_metadata_file_escaped_base64(size):
+    # some JSON encoders escape "/" and wrap base64 lines
+    content = bytes(bytearray(range(256))) * 4
+    data = base64.b64encode(content).decode('ascii')
+    data = '\n'.join(data[i:i + 76] for i in range(0, len(data), 76))
+    text = json.dumps({'filename': 'x', 'data': data, 'type': 'file'})
+    text = text.replace('/', '\\/')
+
+    f = io.BytesIO()
+    result = write_metadata_file(_split(text, size), f)
+    assert f.getvalue() == content
+    assert result == {'type': 'file', 'filename': 'x'}
+
+
+def test_write_metadata_file_invalid_base64():
+    with pytest.raises(ValueError):
+        write_metadata_file(_split('{"data": "abc"}', 1), io.BytesIO())
+
+
+def test_iter_metadata_file_chunk_size(tmpdir):
+    with pytest.raises(ValueError):
+        _upload(tmpdir, b'content', 1000)